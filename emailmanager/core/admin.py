@@ -1,3 +1,20 @@
 from django.contrib import admin
 
 # Register your models here.
+from .models import GmailAccount, Message, SyncState
+
+
+@admin.register(Message)
+class MessageAdmin(admin.ModelAdmin):
+    list_display = ("sender", "subject", "category", "is_unread", "size_estimate", "internal_date")
+    list_filter = ("category", "is_unread")
+    search_fields = ("sender", "subject", "gmail_id")
+
+
+admin.site.register(SyncState)
+
+
+@admin.register(GmailAccount)
+class GmailAccountAdmin(admin.ModelAdmin):
+    list_display = ("email_address", "is_active", "quota_units_per_second", "max_concurrency", "created_at")
+    exclude = ("token",)
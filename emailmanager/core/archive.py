@@ -0,0 +1,227 @@
+import base64
+import os
+import re
+import time
+import zlib
+
+from .services import fetch_messages_batched
+
+
+# ------------------------------------------------------------
+# Compressed mbox archive (written before destructive deletes)
+# ------------------------------------------------------------
+# Layout:
+#   <path>       concatenated gzip members / zstd frames. Each one is a
+#                self-contained "block" of mbox text, so the whole file
+#                still decompresses with plain `gunzip` / `zstd -d`.
+#   <path>.idx   a "# compression=gzip|zstd" header, then one
+#                tab-separated line per message:
+#                message_id  block_offset  block_length  offset  length
+#                (offset/length are inside the decompressed block)
+#
+# Memory use is bounded by `block_size` plus the RAW_BATCH_SIZE *
+# RAW_WORKERS messages in flight, no matter how big the mailbox is.
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+# Raw messages can be up to 25 MB each (plus base64 overhead and the
+# decoded copy), so raw exports keep very few in flight: at most
+# RAW_BATCH_SIZE * RAW_WORKERS messages are in memory at any time.
+RAW_BATCH_SIZE = 5
+RAW_WORKERS = 2
+
+INDEX_HEADER = "# message_id\tblock_offset\tblock_length\toffset\tlength\n"
+COMPRESSION_HEADER = "# compression="
+
+# Leading bytes of a gzip member / zstd frame, for indexes older than the
+# compression header
+_MAGIC = {b"\x1f\x8b": "gzip", b"\x28\xb5\x2f\xfd": "zstd"}
+
+_FROM_LINE = re.compile(rb"^(>*From )", re.MULTILINE)
+
+
+def _compressor(compression):
+    if compression == "gzip":
+        def compress(data):
+            # wbits=31 -> a complete gzip member (header + trailer)
+            c = zlib.compressobj(6, zlib.DEFLATED, 31)
+            return c.compress(data) + c.flush()
+        return compress
+
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd archives need the 'zstandard' package (pip install zstandard)")
+        return zstandard.ZstdCompressor(level=3).compress
+
+    raise ValueError(f"Unknown archive compression: {compression}")
+
+
+def _decompressor(compression):
+    if compression == "gzip":
+        return lambda data: zlib.decompress(data, 31)
+    if compression == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress
+    raise ValueError(f"Unknown archive compression: {compression}")
+
+
+def archive_compression(path):
+    """
+    The compression an existing archive was written with, from its index
+    header (or, for older indexes, the first block's magic bytes). None
+    if there is nothing to tell yet.
+    """
+    if os.path.exists(path + ".idx"):
+        with open(path + ".idx", encoding="utf-8") as f:
+            for line in f:
+                if not line.startswith("#"):
+                    break
+                if line.startswith(COMPRESSION_HEADER):
+                    return line[len(COMPRESSION_HEADER):].strip()
+
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            head = f.read(4)
+        for magic, compression in _MAGIC.items():
+            if head.startswith(magic):
+                return compression
+    return None
+
+
+def _to_mbox_entry(raw, internal_date_ms):
+    """
+    Turns one RFC 822 message into an mboxrd entry: "From " separator line,
+    CRLF -> LF, and any body line starting with ">*From " gets one more ">".
+    """
+    stamp = time.asctime(time.gmtime(internal_date_ms / 1000))
+    body = raw.replace(b"\r\n", b"\n")
+    body = _FROM_LINE.sub(rb">\1", body)
+    if not body.endswith(b"\n"):
+        body += b"\n"
+    return f"From MAILER-DAEMON {stamp}\n".encode() + body + b"\n"
+
+
+class MboxArchiveWriter:
+    """
+    Streams messages into a block-compressed mbox plus an offset index.
+    Appends if the archive already exists, so one file can collect
+    several purge runs, as long as they all use the same compression.
+    """
+
+    def __init__(self, path, compression="gzip", block_size=DEFAULT_BLOCK_SIZE):
+        self.path = path
+        self.compression = compression
+        self.block_size = block_size
+
+        existing = archive_compression(path)
+        if existing and existing != compression:
+            raise ValueError(
+                f"{path} is a {existing} archive; appending {compression} blocks would make it unreadable"
+            )
+        self._compress = _compressor(compression)
+
+        self._file = open(path, "ab")
+        new_index = not os.path.exists(path + ".idx")
+        self._index = open(path + ".idx", "a", encoding="utf-8")
+        if new_index:
+            self._index.write(f"{COMPRESSION_HEADER}{compression}\n")
+            self._index.write(INDEX_HEADER)
+
+        self._block = bytearray()
+        self._pending = []  # (message_id, offset, length) in the open block
+        self.count = 0
+
+    def add(self, message_id, raw, internal_date_ms=0):
+        entry = _to_mbox_entry(raw, internal_date_ms)
+        self._pending.append((message_id, len(self._block), len(entry)))
+        self._block += entry
+        self.count += 1
+
+        if len(self._block) >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Compresses the open block and syncs it, then its index lines, to
+        disk. Call this before deleting anything that was added, so the
+        copy (and a way to find it) survives a crash.
+        """
+        if not self._pending:
+            return
+
+        block_offset = self._file.tell()
+        data = self._compress(bytes(self._block))
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+        for message_id, offset, length in self._pending:
+            self._index.write(f"{message_id}\t{block_offset}\t{len(data)}\t{offset}\t{length}\n")
+        self._index.flush()
+        os.fsync(self._index.fileno())
+
+        self._block = bytearray()
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        self._file.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def export_messages(service, message_ids, writer, workers=RAW_WORKERS, batch_size=RAW_BATCH_SIZE):
+    """
+    Downloads `message_ids` with format="raw" through batched, concurrent
+    requests and streams them into `writer`. Returns the IDs that were
+    archived (and flushed to disk), in input order.
+    """
+    archived = []
+
+    for msg_id, msg in fetch_messages_batched(
+        service, message_ids, format="raw", fields="id,internalDate,raw",
+        batch_size=batch_size, workers=workers
+    ):
+        if not msg or "raw" not in msg:
+            continue
+        raw = base64.urlsafe_b64decode(msg["raw"])
+        writer.add(msg_id, raw, int(msg.get("internalDate", 0)))
+        archived.append(msg_id)
+
+    writer.flush()
+    return archived
+
+
+def load_index(path):
+    """Returns {message_id: (block_offset, block_length, offset, length)}."""
+    index = {}
+    with open(path + ".idx", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            message_id, *numbers = line.rstrip("\n").split("\t")
+            index[message_id] = tuple(int(n) for n in numbers)
+    return index
+
+
+def read_archived_message(path, message_id, compression=None, index=None):
+    """
+    Pulls a single message back out of an archive, decompressing only the
+    block that holds it. Returns the mbox entry as bytes. The compression
+    is read from the archive unless given.
+    """
+    compression = compression or archive_compression(path) or "gzip"
+    index = index if index is not None else load_index(path)
+    block_offset, block_length, offset, length = index[message_id]
+
+    with open(path, "rb") as f:
+        f.seek(block_offset)
+        block = _decompressor(compression)(f.read(block_length))
+    return block[offset:offset + length]
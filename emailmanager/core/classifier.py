@@ -0,0 +1,265 @@
+import math
+import re
+import threading
+import zlib
+
+from django.db import connection
+
+from .models import ClassifierState, Message, ReviewDecision
+
+
+# ------------------------------------------------------------
+# Online keep/delete classifier trained from review clicks
+# ------------------------------------------------------------
+# Logistic regression over hashed sparse features, updated one example
+# at a time with SGD (a partial_fit, never a full retrain). Pure Python
+# so it adds no dependencies; the weights are a sparse dict stored in
+# ClassifierState.
+
+MODEL_NAME = "review"
+HASH_BUCKETS = 2 ** 20
+LEARNING_RATE = 0.1
+L2 = 1e-5
+
+# Don't propose anything until the model has seen this many clicks
+MIN_EXAMPLES = 50
+PROPOSE_THRESHOLD = 0.9
+
+# Re-score the whole backlog after this many new decisions
+RESCORE_EVERY = 25
+RESCORE_BATCH_SIZE = 1000
+
+_WORD = re.compile(r"[a-z0-9']+")
+_lock = threading.Lock()
+
+
+def extract_features(sender, subject, snippet, category="", is_unread=False):
+    """Turns message metadata into a list of hashed feature indices."""
+    sender = sender.lower()
+    address = sender.split("<")[-1].strip(" >\"")
+    domain = address.split("@")[-1]
+
+    tokens = [f"from:{address}", f"domain:{domain}", f"cat:{category}", f"unread:{is_unread}"]
+    for prefix, text in (("subj", subject), ("snip", snippet)):
+        for word in _WORD.findall(text.lower()):
+            if len(word) < 2:
+                continue
+            # Collapse numbers so order IDs / dates don't each get a weight
+            tokens.append(f"{prefix}:{'#' if word.isdigit() else word}")
+
+    return sorted({zlib.crc32(t.encode()) % HASH_BUCKETS for t in tokens})
+
+
+def message_features(message):
+    return extract_features(
+        message.sender, message.subject, message.snippet, message.category, message.is_unread
+    )
+
+
+class OnlineClassifier:
+    """Sparse logistic regression with per-example SGD updates."""
+
+    def __init__(self, state):
+        self.state = state
+        # JSON keys are strings; keep ints in memory
+        self.weights = {int(k): v for k, v in state.weights.items()}
+
+    @classmethod
+    def load(cls, account=None):
+        """Each mailbox trains its own model; account=None is token.json's."""
+        state, _ = ClassifierState.objects.get_or_create(name=MODEL_NAME, account=account)
+        return cls(state)
+
+    @property
+    def examples(self):
+        return self.state.examples
+
+    def predict_proba(self, features):
+        z = self.state.bias + sum(self.weights.get(f, 0.0) for f in features)
+        z = max(-30.0, min(30.0, z))
+        return 1.0 / (1.0 + math.exp(-z))
+
+    def partial_fit(self, features, label):
+        """One SGD step. label is 1 for delete, 0 for keep."""
+        error = self.predict_proba(features) - label
+        for f in features:
+            w = self.weights.get(f, 0.0)
+            self.weights[f] = w - LEARNING_RATE * (error + L2 * w)
+        self.state.bias -= LEARNING_RATE * error
+        self.state.examples += 1
+
+    def save(self):
+        self.state.weights = {str(k): v for k, v in self.weights.items()}
+        self.state.save()
+
+
+def decision_messages(service, gmail_ids, account=None):
+    """
+    The messages behind a set of review clicks: from the local index where
+    possible, the rest fetched from Gmail (batched) for their features.
+    Call this BEFORE deleting anything, since a deleted message can't be
+    read any more. Messages that can't be fetched are left out.
+    """
+    from .services import fetch_messages_batched
+    from .sync import INDEX_FIELDS, INDEX_HEADERS, message_fields
+
+    found = {m.gmail_id: m for m in Message.objects.filter(account=account, gmail_id__in=gmail_ids)}
+    missing = [gmail_id for gmail_id in gmail_ids if gmail_id not in found]
+    for gmail_id, msg in fetch_messages_batched(
+        service, missing, format="metadata", fields=INDEX_FIELDS, metadata_headers=INDEX_HEADERS
+    ):
+        if msg:
+            found[gmail_id] = Message(gmail_id=gmail_id, account=account, **message_fields(msg))
+
+    return [found[gmail_id] for gmail_id in gmail_ids if gmail_id in found]
+
+
+def record_decisions(messages, decision, account=None):
+    """
+    Stores keep/delete clicks on `messages` (from decision_messages()) as
+    labelled examples and trains on them. For deletes, call this only once
+    Gmail has confirmed the delete: it also drops the messages from the
+    local index. Returns the model's example count.
+    """
+    ReviewDecision.objects.bulk_create([
+        ReviewDecision(
+            gmail_id=message.gmail_id,
+            account=account,
+            decision=decision,
+            sender=message.sender,
+            subject=message.subject,
+            snippet=message.snippet,
+            category=message.category,
+            is_unread=message.is_unread,
+        )
+        for message in messages
+    ])
+
+    label = 1 if decision == ReviewDecision.DELETE else 0
+    with _lock:
+        model = OnlineClassifier.load(account)
+        before = model.examples
+        for message in messages:
+            model.partial_fit(message_features(message), label)
+        model.save()
+        examples = model.examples
+
+    if decision == ReviewDecision.DELETE:
+        Message.objects.filter(account=account, gmail_id__in=[m.gmail_id for m in messages]).delete()
+
+    if examples >= MIN_EXAMPLES and examples // RESCORE_EVERY > before // RESCORE_EVERY:
+        start_rescore(account)
+
+    return examples
+
+
+def record_decision(service, gmail_id, decision, account=None):
+    """
+    Stores a single click. Fine for keeps; for deletes use
+    decision_messages() before the Gmail call and record_decisions() after.
+    """
+    return record_decisions(decision_messages(service, [gmail_id], account), decision, account)
+
+
+def score_messages(queryset, model):
+    """Scores `queryset` with `model`. Returns how many were scored."""
+    messages = list(queryset)
+    for message in messages:
+        message.delete_score = model.predict_proba(message_features(message))
+    Message.objects.bulk_update(messages, ["delete_score"])
+    return len(messages)
+
+
+def rescore_backlog(account=None, batch_size=RESCORE_BATCH_SIZE):
+    """
+    Re-scores every message indexed for `account` in primary-key batches,
+    so memory stays flat however large the index grows.
+    """
+    model = OnlineClassifier.load(account)
+    messages = Message.objects.filter(account=account)
+    last_pk = 0
+    scored = 0
+
+    while True:
+        batch = list(messages.filter(pk__gt=last_pk).order_by("pk")[:batch_size])
+        if not batch:
+            break
+        scored += score_messages(batch, model)
+        last_pk = batch[-1].pk
+
+    print(f"Re-scored {scored} messages with a model trained on {model.examples} decisions.")
+    return scored
+
+
+# account pk -> whether another pass was asked for while one was running
+_rescoring = {}
+_rescoring_lock = threading.Lock()
+
+
+def start_rescore(account=None):
+    """
+    Runs rescore_backlog() in a background thread, at most one per
+    account. A request that arrives mid-pass queues a single follow-up
+    pass so the newest weights still get applied. Returns False if it
+    only queued.
+    """
+    key = account.pk if account else None
+    with _rescoring_lock:
+        if key in _rescoring:
+            _rescoring[key] = True
+            return False
+        _rescoring[key] = False
+
+    def run():
+        try:
+            while True:
+                rescore_backlog(account)
+                with _rescoring_lock:
+                    # Deciding and clearing under one lock, so no request is lost
+                    if not _rescoring[key]:
+                        del _rescoring[key]
+                        return
+                    _rescoring[key] = False
+        except Exception as e:
+            print(f"Re-scoring failed: {e}")
+            with _rescoring_lock:
+                _rescoring.pop(key, None)
+        finally:
+            connection.close()
+
+    threading.Thread(target=run, daemon=True).start()
+    return True
+
+
+def propose_deletions(account=None, threshold=PROPOSE_THRESHOLD, limit=1000):
+    """
+    Messages in `account` the model is confident the user would delete,
+    minus anything the user already chose to keep. Empty until the model
+    has MIN_EXAMPLES decisions behind it.
+    """
+    model = OnlineClassifier.load(account)
+    if model.examples < MIN_EXAMPLES:
+        return {"examples": model.examples, "ready": False, "messages": [], "ids": []}
+
+    kept = ReviewDecision.objects.filter(account=account, decision=ReviewDecision.KEEP).values("gmail_id")
+    proposals = (
+        Message.objects.filter(account=account, delete_score__gte=threshold)
+        .exclude(gmail_id__in=kept)
+        .order_by("-delete_score")[:limit]
+    )
+    messages = [
+        {
+            "id": m.gmail_id,
+            "from": m.sender,
+            "subject": m.subject,
+            "category": m.category,
+            "score": round(m.delete_score, 3),
+        }
+        for m in proposals
+    ]
+    return {
+        "examples": model.examples,
+        "ready": True,
+        "messages": messages,
+        "ids": [m["id"] for m in messages],
+    }
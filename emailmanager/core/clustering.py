@@ -0,0 +1,200 @@
+import hashlib
+import re
+from functools import lru_cache
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+
+from .models import Message
+from .services import batch_delete_messages
+
+
+# ------------------------------------------------------------
+# Near-duplicate / template clustering
+# ------------------------------------------------------------
+# Every message gets a 64-bit SimHash of its normalized sender domain,
+# subject and snippet. Two messages from the same template land within a
+# few bits of each other. To avoid comparing all pairs, the fingerprint is
+# split into BANDS blocks: if two fingerprints differ in at most
+# MAX_DISTANCE bits (< BANDS), at least one block matches exactly, so only
+# messages sharing a (band, value) bucket are ever compared.
+#
+# Each bucket only keeps BUCKET_REPS representatives to compare against,
+# which keeps the whole pass linear in the number of messages.
+
+BITS = 64
+BANDS = 4
+BAND_BITS = BITS // BANDS
+MAX_DISTANCE = 3
+BUCKET_REPS = 16
+ITERATOR_CHUNK = 2000
+
+_URL = re.compile(r"https?://\S+|www\.\S+")
+_NUMBER = re.compile(r"\d+")
+_WORD = re.compile(r"[a-z#']+")
+
+
+def normalize(subject, snippet):
+    """Lowercase, drop URLs, collapse numbers so per-recipient bits vanish."""
+    text = f"{subject} {snippet}".lower()
+    text = _URL.sub(" ", text)
+    text = _NUMBER.sub("#", text)
+    return _WORD.findall(text)
+
+
+def simhash(sender, subject, snippet):
+    domain = sender.lower().split("@")[-1].strip(" >\"")
+    return _simhash(domain, tuple(normalize(subject, snippet)))
+
+
+@lru_cache(maxsize=65536)
+def _simhash(domain, words):
+    # Cached because template mail normalizes to the same words over and
+    # over. Word bigrams capture template structure better than words alone.
+    features = [f"from:{domain}"] + list(words) + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    # A bit is set when more than half the feature hashes set it. Rather
+    # than walking 64 bits per feature, all 64 per-bit counters are added
+    # at once: planes[i] holds bit i of every counter, and each hash is
+    # ripple-carried in.
+    planes = []
+    for feature in features:
+        carry = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big")
+        for i, plane in enumerate(planes):
+            if not carry:
+                break
+            planes[i], carry = plane ^ carry, plane & carry
+        if carry:
+            planes.append(carry)
+
+    # Compare every counter with len(features) // 2, most significant bit first
+    half = len(features) // 2
+    greater, equal = 0, (1 << BITS) - 1
+    for i in reversed(range(max(len(planes), half.bit_length()))):
+        plane = planes[i] if i < len(planes) else 0
+        if half >> i & 1:
+            equal &= plane
+        else:
+            greater |= equal & plane
+            equal &= ~plane
+    return greater
+
+
+class _UnionFind:
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def cluster_messages(account=None):
+    """
+    Recomputes cluster_key for every message indexed for `account`.
+    Returns the number of clusters with two or more messages.
+    """
+    messages = Message.objects.filter(account=account)
+    pks = []
+    fingerprints = []
+    for pk, sender, subject, snippet in (
+        messages.order_by("pk")
+        .values_list("pk", "sender", "subject", "snippet")
+        .iterator(chunk_size=ITERATOR_CHUNK)
+    ):
+        pks.append(pk)
+        fingerprints.append(simhash(sender, subject, snippet))
+
+    uf = _UnionFind(len(pks))
+
+    # Identical fingerprints (the bulk of any template) union for free
+    first_seen = {}
+    for i, fp in enumerate(fingerprints):
+        if fp in first_seen:
+            uf.union(first_seen[fp], i)
+        else:
+            first_seen[fp] = i
+
+    buckets = {}
+    mask = (1 << BAND_BITS) - 1
+    for fp, i in first_seen.items():
+        for band in range(BANDS):
+            reps = buckets.setdefault((band, fp >> (band * BAND_BITS) & mask), [])
+            for j in reps:
+                if bin(fp ^ fingerprints[j]).count("1") <= MAX_DISTANCE:
+                    uf.union(i, j)
+                    break
+            else:
+                if len(reps) < BUCKET_REPS:
+                    reps.append(i)
+
+    members = {}
+    for i, pk in enumerate(pks):
+        members.setdefault(uf.find(i), []).append(pk)
+
+    # One UPDATE per cluster (chunked for SQLite's parameter limit);
+    # singletons get "" so they drop out of the API. Atomic, so readers
+    # (and delete_cluster) never see a half-rewritten set of keys.
+    with transaction.atomic():
+        messages.exclude(cluster_key="").update(cluster_key="")
+        for root, cluster_pks in members.items():
+            if len(cluster_pks) < 2:
+                continue
+            key = f"{fingerprints[root]:016x}"
+            for start in range(0, len(cluster_pks), ITERATOR_CHUNK):
+                messages.filter(pk__in=cluster_pks[start:start + ITERATOR_CHUNK]).update(cluster_key=key)
+
+    clusters = sum(1 for cluster_pks in members.values() if len(cluster_pks) > 1)
+    print(f"Clustered {len(pks)} messages into {clusters} templates.")
+    return clusters
+
+
+def list_clusters(account=None, min_size=2, limit=200):
+    """Clusters, largest first, with a sample sender/subject for each."""
+    rows = (
+        Message.objects.filter(account=account)
+        .exclude(cluster_key="")
+        .values("cluster_key")
+        .annotate(
+            count=Count("id"),
+            bytes=Sum("size_estimate"),
+            sample_from=Min("sender"),
+            sample_subject=Min("subject"),
+            newest=Max("internal_date"),
+        )
+        .filter(count__gte=min_size)
+        .order_by("-count")[:limit]
+    )
+    return [
+        {
+            "key": row["cluster_key"],
+            "count": row["count"],
+            "bytes": row["bytes"] or 0,
+            "sample_from": row["sample_from"],
+            "sample_subject": row["sample_subject"],
+            "newest": row["newest"].isoformat() if row["newest"] else None,
+        }
+        for row in rows
+    ]
+
+
+def delete_cluster(service, cluster_key, account=None):
+    """Permanently deletes every message in one of `account`'s clusters via batchDelete."""
+    messages = Message.objects.filter(account=account)
+    ids = list(messages.filter(cluster_key=cluster_key).values_list("gmail_id", flat=True))
+    if not ids:
+        return 0
+
+    from .review import discard_everywhere
+
+    deleted = batch_delete_messages(service, ids)
+    messages.filter(gmail_id__in=ids).delete()
+    discard_everywhere(ids)
+    return deleted
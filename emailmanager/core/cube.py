@@ -0,0 +1,199 @@
+import threading
+from datetime import datetime
+
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+from .models import MailboxCubeCell, Message
+from .scheduler import QUOTA_COSTS
+from .services import schedule, thread_http
+
+
+# ------------------------------------------------------------
+# Mailbox composition cube
+# ------------------------------------------------------------
+# Precomputed counts (and bytes, when known) by
+#   year x month x category x unread
+# so the whole-mailbox overview is a single query instead of a dry run
+# per year/category. Two ways to fill it:
+#   - from the local Message index (exact, includes bytes, no API calls)
+#   - from resultSizeEstimate probes, run in parallel as fair-scheduler
+#     jobs (approximate, but works before anything has been indexed)
+
+# Index category name -> Gmail search term. Gmail labels the Primary tab
+# CATEGORY_PERSONAL, which is why the index calls it "personal".
+CATEGORIES = {
+    "personal": "primary",
+    "social": "social",
+    "promotions": "promotions",
+    "updates": "updates",
+    "forums": "forums",
+}
+
+
+def _replace_cells(account, cells, source, years=None):
+    """Swaps in `cells`, for every year or only the `years` (from, to) range."""
+    existing = MailboxCubeCell.objects.filter(account=account)
+    if years:
+        existing = existing.filter(year__gte=years[0], year__lte=years[1])
+    with transaction.atomic():
+        existing.delete()
+        MailboxCubeCell.objects.bulk_create(cells, batch_size=1000)
+    print(f"Mailbox cube rebuilt from {source}: {len(cells)} cells.")
+    return len(cells)
+
+
+def build_cube_from_index(account=None):
+    """Aggregates `account`'s local index into its cube with a single GROUP BY."""
+    rows = (
+        Message.objects.filter(account=account)
+        .exclude(internal_date=None)
+        .annotate(year=ExtractYear("internal_date"), month=ExtractMonth("internal_date"))
+        .values("year", "month", "category", "is_unread")
+        .annotate(count=Count("id"), bytes=Sum("size_estimate"))
+        .order_by()
+    )
+    cells = [MailboxCubeCell(account=account, source=MailboxCubeCell.SOURCE_INDEX, **row) for row in rows]
+    return _replace_cells(account, cells, "local index")
+
+
+def _probe(service, year, month, category, is_unread):
+    start = f"{year}/{month:02d}/01"
+    end = f"{year + 1}/01/01" if month == 12 else f"{year}/{month + 1:02d}/01"
+    query = (
+        f"category:{CATEGORIES[category]} {'is:unread' if is_unread else 'is:read'} "
+        f"after:{start} before:{end}"
+    )
+    response = service.users().messages().list(
+        userId="me",
+        q=query,
+        maxResults=1,
+        fields="resultSizeEstimate"
+    ).execute(http=thread_http(service))
+    return response.get("resultSizeEstimate", 0)
+
+
+def build_cube_from_estimates(service, from_year, to_year=None, account=None):
+    """
+    Fills the cube with one cheap resultSizeEstimate probe per cell, each
+    a messages.list job on the account's scheduler queue (which sets the
+    parallelism). Counts are Gmail's estimates; bytes stay unknown.
+
+    Only cells in [from_year, to_year] are replaced. A cell whose probe
+    fails keeps its previous value and is marked stale, so one flaky
+    request can't silently zero part of the overview.
+
+    Takes as long as ~2 probes per cell at the account's quota (minutes for
+    a decade), so callers outside a command use start_estimate_rebuild().
+    """
+    to_year = to_year or datetime.now().year
+    keys = [
+        (year, month, category, is_unread)
+        for year in range(from_year, to_year + 1)
+        for month in range(1, 13)
+        for category in CATEGORIES
+        for is_unread in (True, False)
+    ]
+
+    futures = [schedule(service, _probe, service, *key, cost=QUOTA_COSTS["messages.list"]) for key in keys]
+
+    results = []
+    for key, future in zip(keys, futures):
+        try:
+            results.append((key, future.result()))
+        except Exception as e:
+            print(f"Probe failed for {key}: {e}")
+            results.append((key, None))
+
+    if all(count is None for _, count in results):
+        print("Every probe failed; keeping the existing cube.")
+        return 0
+
+    previous = {
+        (cell.year, cell.month, cell.category, cell.is_unread): cell
+        for cell in MailboxCubeCell.objects.filter(account=account, year__gte=from_year, year__lte=to_year)
+    }
+
+    cells = []
+    failed = 0
+    for key, count in results:
+        year, month, category, is_unread = key
+        cell = MailboxCubeCell(
+            account=account, year=year, month=month, category=category, is_unread=is_unread,
+            count=count, bytes=None, source=MailboxCubeCell.SOURCE_ESTIMATE
+        )
+        if count is None:
+            failed += 1
+            old = previous.get(key)
+            cell.count = old.count if old else 0
+            cell.bytes = old.bytes if old else None
+            cell.source = old.source if old else MailboxCubeCell.SOURCE_ESTIMATE
+            cell.stale = True
+        elif not count:
+            continue
+        cells.append(cell)
+
+    if failed:
+        print(f"{failed} probes failed; those cells keep their previous values and are marked stale.")
+    return _replace_cells(account, cells, "resultSizeEstimate probes", years=(from_year, to_year))
+
+
+_rebuilding = set()
+_rebuilding_lock = threading.Lock()
+
+
+def start_estimate_rebuild(service, from_year, to_year=None, account=None):
+    """
+    Runs build_cube_from_estimates() in a background thread. Returns False
+    (and starts nothing) if a rebuild is already running for the account.
+    """
+    key = account.pk if account else None
+    with _rebuilding_lock:
+        if key in _rebuilding:
+            return False
+        _rebuilding.add(key)
+
+    def run():
+        try:
+            build_cube_from_estimates(service, from_year, to_year, account=account)
+        except Exception as e:
+            print(f"Cube rebuild failed: {e}")
+        finally:
+            with _rebuilding_lock:
+                _rebuilding.discard(key)
+            connection.close()
+
+    threading.Thread(target=run, daemon=True).start()
+    return True
+
+
+def get_cube(account=None):
+    """`account`'s stored cube plus per-year totals, ready to return as JSON."""
+    cells = list(
+        MailboxCubeCell.objects.filter(account=account).order_by("year", "month", "category", "is_unread").values(
+            "year", "month", "category", "is_unread", "count", "bytes", "source", "stale", "updated_at"
+        )
+    )
+
+    years = {}
+    for cell in cells:
+        total = years.setdefault(
+            cell["year"], {"year": cell["year"], "count": 0, "unread": 0, "bytes": 0, "stale": False}
+        )
+        total["count"] += cell["count"]
+        if cell["is_unread"]:
+            total["unread"] += cell["count"]
+        total["bytes"] += cell["bytes"] or 0
+        total["stale"] = total["stale"] or cell["stale"]
+
+    stale = sum(1 for c in cells if c["stale"])
+    return {
+        "cells": cells,
+        "years": list(years.values()),
+        "source": cells[0]["source"] if cells else None,
+        "updated_at": max((c["updated_at"] for c in cells), default=None),
+        # Cells whose last probe failed; their counts may be out of date
+        "stale_cells": stale,
+        "complete": not stale,
+    }
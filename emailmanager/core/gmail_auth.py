@@ -1,7 +1,14 @@
+import json
 import os
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+import threading
+from contextlib import nullcontext
+from functools import lru_cache
+from django.conf import settings
+
+# The Google client libraries are imported inside the functions below:
+# they take a few hundred ms to import, and every management command,
+# test run and worker imports this module via core.views whether or not
+# it ever talks to Gmail.
 
 # SCOPES = [
 #     "https://www.googleapis.com/auth/gmail.readonly",
@@ -16,14 +23,26 @@ CREDS_PATH = "credentials.json"
 TOKEN_PATH = "token.json"
 
 
-def authenticate_gmail():
+def authenticate_gmail(account=None):
     """
+    Returns a Gmail client.
+
+    With `account` (a GmailAccount or its email address) the client is
+    built from that account's stored token; see account_service().
+    Without it, falls back to the single-mailbox token.json setup below.
+
     OAuth flow using run_local_server() safely.
     - open_browser=False avoids Edge opening automatically
     - port=0 binds any free port (no Errno 48)
     - URL prints to console so you can open it manually in Chrome
     """
 
+    if account is not None:
+        return account_service(account)
+
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     creds = None
 
     # Reuse existing token if present
@@ -44,4 +63,130 @@ def authenticate_gmail():
         with open(TOKEN_PATH, "w") as token:
             token.write(creds.to_json())
 
-    return build("gmail", "v1", credentials=creds)
+    return build_gmail_service(creds, pool_key=TOKEN_PATH)
+
+
+def build_gmail_service(creds, pool_key):
+    """
+    Builds the Gmail client on the configured transport.
+    GMAIL_HTTP_TRANSPORT = "pooled" shares one keep-alive connection pool
+    per `pool_key` across the whole process (see core/transport.py).
+    """
+    from googleapiclient.discovery import build_from_document
+
+    if settings.GMAIL_HTTP_TRANSPORT == "pooled":
+        from .transport import pooled_http
+
+        http = pooled_http(
+            pool_key,
+            creds,
+            pool_size=settings.GMAIL_HTTP_POOL_SIZE,
+            timeout=settings.GMAIL_HTTP_TIMEOUT,
+        )
+        return build_from_document(discovery_document(), http=http)
+
+    return build_from_document(discovery_document(), credentials=creds)
+
+
+@lru_cache(maxsize=1)
+def discovery_document():
+    """
+    The Gmail v1 discovery document, read once per process.
+    Uses the pinned copy at GMAIL_DISCOVERY_DOCUMENT if there is one
+    (see the cache_discovery_document command), otherwise the copy that
+    ships with google-api-python-client. Either way build() never has to
+    fetch it over the network.
+    """
+    path = settings.GMAIL_DISCOVERY_DOCUMENT
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+
+    from googleapiclient.discovery_cache import get_static_doc
+    return get_static_doc("gmail", "v1")
+
+
+# ------------------------------------------------------------
+# Multi-account support
+# ------------------------------------------------------------
+# Each GmailAccount keeps its own token in the database and gets its own
+# client (and, with the pooled transport, its own connection pool), so
+# one mailbox's traffic and credentials never leak into another's.
+
+_account_services = {}
+_account_lock = threading.Lock()
+_thread_local = threading.local()
+
+
+def _get_account(account):
+    from .models import GmailAccount
+
+    if isinstance(account, GmailAccount):
+        return account
+    return GmailAccount.objects.get(email_address=account, is_active=True)
+
+
+def account_credentials(account):
+    """
+    Loads an account's credentials, refreshing (and re-saving) the token
+    if it has expired.
+    """
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+
+    account = _get_account(account)
+    creds = Credentials.from_authorized_user_info(json.loads(account.token), SCOPES)
+    if not creds.valid and creds.refresh_token:
+        creds.refresh(Request())
+        account.token = creds.to_json()
+        account.save(update_fields=["token"])
+    return creds
+
+
+def account_service(account):
+    """
+    Cached Gmail client for one account. With the pooled (thread-safe)
+    transport one client is shared per process; with httplib2 each thread
+    gets its own, since httplib2 connections can't be shared.
+    """
+    account = _get_account(account)
+    key = f"account:{account.email_address}"
+
+    if settings.GMAIL_HTTP_TRANSPORT == "pooled":
+        cache, lock = _account_services, _account_lock
+    else:
+        cache = getattr(_thread_local, "services", None)
+        if cache is None:
+            cache = _thread_local.services = {}
+        lock = nullcontext()
+
+    with lock:
+        service = cache.get(key)
+        if service is None or not service._http.credentials.valid:
+            service = cache[key] = build_gmail_service(account_credentials(account), pool_key=key)
+            # Charges this client's calls to the account's queue in core/scheduler.py
+            service.scheduler_key = account.email_address
+    return service
+
+
+def connect_account():
+    """
+    Runs the OAuth flow for a new mailbox and stores its token as a
+    GmailAccount (or refreshes the token of an existing one).
+    """
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from googleapiclient.discovery import build_from_document
+    from .models import GmailAccount
+
+    flow = InstalledAppFlow.from_client_secrets_file(CREDS_PATH, SCOPES)
+    creds = flow.run_local_server(open_browser=False, port=0)
+
+    service = build_from_document(discovery_document(), credentials=creds)
+    email_address = service.users().getProfile(userId="me").execute()["emailAddress"]
+
+    account, _ = GmailAccount.objects.update_or_create(
+        email_address=email_address,
+        defaults={"token": creds.to_json(), "is_active": True},
+    )
+    print(f"Connected {email_address}")
+    return account
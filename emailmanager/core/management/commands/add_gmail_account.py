@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.gmail_auth import connect_account
+
+
+class Command(BaseCommand):
+    help = "Connect another Gmail mailbox (runs the OAuth flow and stores its token)."
+
+    def handle(self, *args, **options):
+        account = connect_account()
+        self.stdout.write(self.style.SUCCESS(f"Connected {account.email_address}"))
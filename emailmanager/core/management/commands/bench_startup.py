@@ -0,0 +1,83 @@
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Runs in a fresh interpreter so nothing is already imported
+IMPORT_SNIPPET = "import django; django.setup(); import {module}"
+
+FIRST_REQUEST_SNIPPET = """
+import time
+import django
+django.setup()
+from django.test import Client
+from django.test.utils import setup_test_environment
+setup_test_environment()  # lets the test client's host through ALLOWED_HOSTS
+response = Client().get({path!r})
+print(time.time(), response.status_code)
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Startup benchmark: `python -X importtime` breakdown for a module "
+        "plus time-to-first-request in a fresh process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--module", default="core.views", help="Module to import")
+        parser.add_argument("--path", default="/", help="URL for the first-request timing")
+        parser.add_argument("--top", type=int, default=15, help="Slowest imports to list")
+        parser.add_argument("--runs", type=int, default=3, help="Take the best of N runs")
+
+    def _run(self, code, *flags):
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": os.environ.get(
+            "DJANGO_SETTINGS_MODULE", settings.SETTINGS_MODULE
+        )}
+        started = time.time()
+        result = subprocess.run(
+            [sys.executable, *flags, "-c", code],
+            capture_output=True, text=True, env=env, cwd=settings.BASE_DIR,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1])
+        return started, result
+
+    def handle(self, *args, **options):
+        runs = options["runs"]
+
+        # 1. Import profile
+        best = None
+        for _ in range(runs):
+            _, result = self._run(IMPORT_SNIPPET.format(module=options["module"]), "-X", "importtime")
+            rows = []
+            for line in result.stderr.splitlines():
+                if not line.startswith("import time:") or "self [us]" in line:
+                    continue
+                # "import time:   self |   cumulative | name"
+                head, cumulative_us, name = line.split("|")
+                rows.append((int(cumulative_us), int(head.split(":")[1]), name.rstrip()))
+            total = sum(self_us for _, self_us, _ in rows)
+            if best is None or total < best[0]:
+                best = (total, rows)
+
+        total, rows = best
+        self.stdout.write(f"Importing {options['module']} (best of {runs}): {total / 1000:.1f} ms total\n")
+        self.stdout.write(f"{'cumulative ms':>14} {'self ms':>9}  module")
+        for cumulative_us, self_us, name in sorted(rows, reverse=True)[:options["top"]]:
+            self.stdout.write(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {name}")
+
+        # 2. Time to first request (process start -> response)
+        timings = []
+        for _ in range(runs):
+            started, result = self._run(FIRST_REQUEST_SNIPPET.format(path=options["path"]))
+            finished, status_code = result.stdout.split()[-2:]
+            timings.append(float(finished) - started)
+
+        self.stdout.write(
+            f"\nTime to first request for {options['path']} (status {status_code}): "
+            f"best {min(timings) * 1000:.0f} ms, worst {max(timings) * 1000:.0f} ms over {runs} runs"
+        )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.cube import build_cube_from_estimates, build_cube_from_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the mailbox composition cube (year x month x category x unread)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--account", help="Connected mailbox (defaults to token.json's)")
+        parser.add_argument("--source", choices=["index", "estimate"], default="index")
+        parser.add_argument("--from-year", type=int, default=2010)
+        parser.add_argument("--to-year", type=int)
+
+    def handle(self, *args, **options):
+        from core.models import GmailAccount
+
+        account = None
+        if options["account"]:
+            account = GmailAccount.objects.filter(email_address=options["account"], is_active=True).first()
+            if account is None:
+                raise CommandError(f"No connected Gmail account {options['account']}")
+
+        if options["source"] == "index":
+            cells = build_cube_from_index(account)
+        else:
+            from core.gmail_auth import authenticate_gmail
+
+            cells = build_cube_from_estimates(
+                authenticate_gmail(account),
+                options["from_year"],
+                options["to_year"],
+                account=account,
+            )
+        self.stdout.write(self.style.SUCCESS(f"Cube has {cells} cells."))
@@ -0,0 +1,31 @@
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+DISCOVERY_URL = "https://gmail.googleapis.com/$discovery/rest?version=v1"
+
+
+class Command(BaseCommand):
+    help = (
+        "Pin the Gmail discovery document to GMAIL_DISCOVERY_DOCUMENT so "
+        "build() reads it from disk. Uses the copy bundled with "
+        "google-api-python-client unless --download is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--download", action="store_true",
+                            help=f"Fetch the latest document from {DISCOVERY_URL}")
+
+    def handle(self, *args, **options):
+        if options["download"]:
+            with urllib.request.urlopen(DISCOVERY_URL) as response:
+                document = response.read().decode("utf-8")
+        else:
+            from googleapiclient.discovery_cache import get_static_doc
+            document = get_static_doc("gmail", "v1")
+
+        path = settings.GMAIL_DISCOVERY_DOCUMENT
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(document)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(document)} bytes to {path}"))
@@ -0,0 +1,53 @@
+import base64
+import json
+import time
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Local stand-in for Pub/Sub: POSTs a burst of Gmail push notifications "
+        "to the webhook so debouncing and history sync can be exercised "
+        "without a real Google Cloud topic."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("email_address")
+        parser.add_argument("history_id", type=int)
+        parser.add_argument("--url", default="http://127.0.0.1:8000/api/gmail/push/")
+        parser.add_argument("--count", type=int, default=10, help="Notifications in the burst")
+        parser.add_argument("--interval", type=float, default=0.05, help="Seconds between notifications")
+
+    def handle(self, *args, **options):
+        if not settings.GMAIL_PUSH_TOKEN:
+            raise CommandError("Set GMAIL_PUSH_TOKEN; the push endpoint refuses requests without it.")
+        url = f"{options['url']}?token={settings.GMAIL_PUSH_TOKEN}"
+
+        for i in range(options["count"]):
+            payload = {
+                "emailAddress": options["email_address"],
+                "historyId": options["history_id"] + i,
+            }
+            envelope = {
+                "message": {
+                    "data": base64.b64encode(json.dumps(payload).encode()).decode(),
+                    "messageId": f"fake-{int(time.time() * 1000)}-{i}",
+                },
+                "subscription": "projects/local/subscriptions/fake",
+            }
+            request = urllib.request.Request(
+                url,
+                data=json.dumps(envelope).encode(),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            with urllib.request.urlopen(request) as response:
+                self.stdout.write(f"#{i + 1} historyId={payload['historyId']} -> {response.status}")
+            time.sleep(options["interval"])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {options['count']} notifications; expect a single coalesced sync."
+        ))
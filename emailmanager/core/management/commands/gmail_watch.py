@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.gmail_auth import authenticate_gmail
+from core.sync import start_watch
+
+
+class Command(BaseCommand):
+    help = "Register (or renew) Gmail push notifications. Watches expire after 7 days."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--account", help="Connected mailbox (defaults to token.json's)")
+        parser.add_argument("--all-accounts", action="store_true",
+                            help="Renew the watch of every active connected mailbox")
+        parser.add_argument("--topic", help="Pub/Sub topic (defaults to GMAIL_PUSH_TOPIC)")
+        parser.add_argument("--label", action="append", dest="labels",
+                            help="Only notify for this label ID (repeatable)")
+
+    def handle(self, *args, **options):
+        from core.models import GmailAccount
+
+        if options["all_accounts"]:
+            accounts = list(GmailAccount.objects.filter(is_active=True))
+        elif options["account"]:
+            account = GmailAccount.objects.filter(email_address=options["account"], is_active=True).first()
+            if account is None:
+                raise CommandError(f"No connected Gmail account {options['account']}")
+            accounts = [account]
+        else:
+            accounts = [None]
+
+        for account in accounts:
+            state = start_watch(
+                authenticate_gmail(account), topic=options["topic"], label_ids=options["labels"], account=account
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"Watching {state.email_address} from history {state.history_id} "
+                f"until {state.watch_expiration}"
+            ))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.gmail_auth import authenticate_gmail
+from core.sync import backfill_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the local message index from scratch (metadata only). Run this "
+        "once per mailbox before relying on proposals, clusters or the cube; "
+        "push notifications keep it current afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--account", help="Connected mailbox (defaults to token.json's)")
+        parser.add_argument("--query", default="", help="Only index messages matching this Gmail search")
+        parser.add_argument("--no-derived", action="store_true",
+                            help="Skip re-clustering and rebuilding the cube afterwards")
+
+    def handle(self, *args, **options):
+        from core.clustering import cluster_messages
+        from core.cube import build_cube_from_index
+        from core.models import GmailAccount
+
+        account = None
+        if options["account"]:
+            account = GmailAccount.objects.filter(email_address=options["account"], is_active=True).first()
+            if account is None:
+                raise CommandError(f"No connected Gmail account {options['account']}")
+
+        indexed = backfill_index(authenticate_gmail(account), account=account, query=options["query"])
+
+        # index_messages() already scored everything with the current model
+        if not options["no_derived"]:
+            cluster_messages(account)
+            build_cube_from_index(account)
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} messages."))
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-19 10:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Message',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gmail_id', models.CharField(max_length=64, unique=True)),
+                ('thread_id', models.CharField(blank=True, max_length=64)),
+                ('sender', models.CharField(blank=True, max_length=512)),
+                ('subject', models.TextField(blank=True)),
+                ('snippet', models.TextField(blank=True)),
+                ('label_ids', models.JSONField(default=list)),
+                ('category', models.CharField(blank=True, max_length=20)),
+                ('is_unread', models.BooleanField(default=False)),
+                ('size_estimate', models.IntegerField(default=0)),
+                ('internal_date', models.DateTimeField(db_index=True, null=True)),
+                ('indexed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email_address', models.CharField(max_length=254, unique=True)),
+                ('history_id', models.BigIntegerField(null=True)),
+                ('watch_expiration', models.DateTimeField(null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.8 on 2026-10-19 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClassifierState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('weights', models.JSONField(default=dict)),
+                ('bias', models.FloatField(default=0.0)),
+                ('examples', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReviewDecision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gmail_id', models.CharField(db_index=True, max_length=64)),
+                ('decision', models.CharField(choices=[('keep', 'Keep'), ('delete', 'Delete')], max_length=10)),
+                ('sender', models.CharField(blank=True, max_length=512)),
+                ('subject', models.TextField(blank=True)),
+                ('snippet', models.TextField(blank=True)),
+                ('category', models.CharField(blank=True, max_length=20)),
+                ('is_unread', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='delete_score',
+            field=models.FloatField(db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 10:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_review_learning'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='cluster_key',
+            field=models.CharField(blank=True, db_index=True, max_length=16),
+        ),
+    ]
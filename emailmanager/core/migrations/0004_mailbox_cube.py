@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-19 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_message_cluster_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailboxCubeCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('month', models.IntegerField()),
+                ('category', models.CharField(blank=True, max_length=20)),
+                ('is_unread', models.BooleanField()),
+                ('count', models.IntegerField(default=0)),
+                ('bytes', models.BigIntegerField(null=True)),
+                ('source', models.CharField(choices=[('index', 'Local index'), ('estimate', 'resultSizeEstimate probes')], max_length=10)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('year', 'month', 'category', 'is_unread'), name='unique_cube_cell')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-19 10:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_mailbox_cube'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GmailAccount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email_address', models.CharField(max_length=254, unique=True)),
+                ('token', models.TextField(help_text='Authorized-user JSON from google-auth')),
+                ('is_active', models.BooleanField(default=True)),
+                ('quota_units_per_second', models.IntegerField(default=250)),
+                ('max_concurrency', models.IntegerField(default=4)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='account',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.gmailaccount'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.8 on 2026-10-19 10:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_gmail_accounts'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='mailboxcubecell',
+            name='unique_cube_cell',
+        ),
+        migrations.AddField(
+            model_name='classifierstate',
+            name='account',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.gmailaccount'),
+        ),
+        migrations.AddField(
+            model_name='mailboxcubecell',
+            name='account',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.gmailaccount'),
+        ),
+        migrations.AddField(
+            model_name='reviewdecision',
+            name='account',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.gmailaccount'),
+        ),
+        migrations.AlterField(
+            model_name='classifierstate',
+            name='name',
+            field=models.CharField(max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='gmail_id',
+            field=models.CharField(max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='classifierstate',
+            constraint=models.UniqueConstraint(fields=('account', 'name'), name='unique_account_classifier'),
+        ),
+        migrations.AddConstraint(
+            model_name='classifierstate',
+            constraint=models.UniqueConstraint(condition=models.Q(('account', None)), fields=('name',), name='unique_legacy_classifier'),
+        ),
+        migrations.AddConstraint(
+            model_name='mailboxcubecell',
+            constraint=models.UniqueConstraint(fields=('account', 'year', 'month', 'category', 'is_unread'), name='unique_cube_cell'),
+        ),
+        migrations.AddConstraint(
+            model_name='mailboxcubecell',
+            constraint=models.UniqueConstraint(condition=models.Q(('account', None)), fields=('year', 'month', 'category', 'is_unread'), name='unique_legacy_cube_cell'),
+        ),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('account', 'gmail_id'), name='unique_account_message'),
+        ),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(condition=models.Q(('account', None)), fields=('gmail_id',), name='unique_legacy_message'),
+        ),
+    ]
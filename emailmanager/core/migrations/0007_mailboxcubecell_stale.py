@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 10:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_account_scoping'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailboxcubecell',
+            name='stale',
+            field=models.BooleanField(default=False),
+        ),
+    ]
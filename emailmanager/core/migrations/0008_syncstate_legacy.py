@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-19 11:05
+
+from django.db import migrations, models
+
+
+def mark_legacy(apps, schema_editor):
+    # Before this flag, the only watched mailboxes without a GmailAccount
+    # row were the token.json one
+    SyncState = apps.get_model("core", "SyncState")
+    GmailAccount = apps.get_model("core", "GmailAccount")
+    accounts = GmailAccount.objects.values("email_address")
+    SyncState.objects.exclude(email_address__in=accounts).update(legacy=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_mailboxcubecell_stale'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncstate',
+            name='legacy',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_legacy, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,157 @@
 from django.db import models
 
 # Create your models here.
+
+
+class GmailAccount(models.Model):
+    """
+    A connected mailbox. The OAuth token lives here instead of token.json
+    so any number of accounts can be served side by side.
+    """
+    email_address = models.CharField(max_length=254, unique=True)
+    token = models.TextField(help_text="Authorized-user JSON from google-auth")
+    is_active = models.BooleanField(default=True)
+    # Gmail allows 250 quota units per user per second
+    quota_units_per_second = models.IntegerField(default=250)
+    max_concurrency = models.IntegerField(default=4)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.email_address
+
+
+class Message(models.Model):
+    """
+    Local index of a Gmail message (metadata only, never the body).
+    Kept current by the push/history sync in core/sync.py.
+    """
+    gmail_id = models.CharField(max_length=64)
+    # null for the legacy single-mailbox (token.json) setup
+    account = models.ForeignKey(GmailAccount, null=True, blank=True, on_delete=models.CASCADE)
+    thread_id = models.CharField(max_length=64, blank=True)
+    sender = models.CharField(max_length=512, blank=True)
+    subject = models.TextField(blank=True)
+    snippet = models.TextField(blank=True)
+    label_ids = models.JSONField(default=list)
+    category = models.CharField(max_length=20, blank=True)
+    is_unread = models.BooleanField(default=False)
+    size_estimate = models.IntegerField(default=0)
+    internal_date = models.DateTimeField(null=True, db_index=True)
+    indexed_at = models.DateTimeField(auto_now=True)
+    # Probability the user would delete this, from core/classifier.py
+    delete_score = models.FloatField(null=True, db_index=True)
+    # Near-duplicate/template cluster from core/clustering.py ("" = singleton)
+    cluster_key = models.CharField(max_length=16, blank=True, db_index=True)
+
+    class Meta:
+        # Gmail IDs are only unique within one mailbox. NULLs never clash
+        # in a unique index, so the token.json mailbox gets its own.
+        constraints = [
+            models.UniqueConstraint(fields=["account", "gmail_id"], name="unique_account_message"),
+            models.UniqueConstraint(
+                fields=["gmail_id"], condition=models.Q(account=None), name="unique_legacy_message"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.sender}: {self.subject[:50]}"
+
+
+class SyncState(models.Model):
+    """
+    Where the history sync left off for a mailbox, plus the current
+    users().watch() registration (watches expire after 7 days).
+    """
+    email_address = models.CharField(max_length=254, unique=True)
+    # True only for the single-mailbox token.json setup (set by gmail_watch
+    # or index_mailbox without --account); pushes for it use token.json
+    legacy = models.BooleanField(default=False)
+    history_id = models.BigIntegerField(null=True)
+    watch_expiration = models.DateTimeField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.email_address} @ {self.history_id}"
+
+
+class ReviewDecision(models.Model):
+    """
+    A keep/delete click from the review UI, stored as a labelled example.
+    The message fields are copied because deleted messages leave the index.
+    """
+    KEEP = "keep"
+    DELETE = "delete"
+    DECISIONS = [(KEEP, "Keep"), (DELETE, "Delete")]
+
+    gmail_id = models.CharField(max_length=64, db_index=True)
+    account = models.ForeignKey(GmailAccount, null=True, blank=True, on_delete=models.CASCADE)
+    decision = models.CharField(max_length=10, choices=DECISIONS)
+    sender = models.CharField(max_length=512, blank=True)
+    subject = models.TextField(blank=True)
+    snippet = models.TextField(blank=True)
+    category = models.CharField(max_length=20, blank=True)
+    is_unread = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.decision}: {self.sender}"
+
+
+class ClassifierState(models.Model):
+    """Persisted weights of the online keep/delete classifier (one per mailbox)."""
+    name = models.CharField(max_length=50)
+    account = models.ForeignKey(GmailAccount, null=True, blank=True, on_delete=models.CASCADE)
+    weights = models.JSONField(default=dict)
+    bias = models.FloatField(default=0.0)
+    examples = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["account", "name"], name="unique_account_classifier"),
+            models.UniqueConstraint(
+                fields=["name"], condition=models.Q(account=None), name="unique_legacy_classifier"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.examples} examples)"
+
+
+class MailboxCubeCell(models.Model):
+    """
+    One cell of the precomputed mailbox composition cube:
+    year x month x Gmail category x read state -> count (and bytes).
+    Filled by core/cube.py; bytes is null for estimate-only cells, and
+    stale cells are ones whose probe failed on the last rebuild (they keep
+    the previous count, or 0 if there was none).
+    """
+    SOURCE_INDEX = "index"
+    SOURCE_ESTIMATE = "estimate"
+    SOURCES = [(SOURCE_INDEX, "Local index"), (SOURCE_ESTIMATE, "resultSizeEstimate probes")]
+
+    account = models.ForeignKey(GmailAccount, null=True, blank=True, on_delete=models.CASCADE)
+    year = models.IntegerField()
+    month = models.IntegerField()
+    category = models.CharField(max_length=20, blank=True)
+    is_unread = models.BooleanField()
+    count = models.IntegerField(default=0)
+    bytes = models.BigIntegerField(null=True)
+    source = models.CharField(max_length=10, choices=SOURCES)
+    stale = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["account", "year", "month", "category", "is_unread"], name="unique_cube_cell"
+            ),
+            models.UniqueConstraint(
+                fields=["year", "month", "category", "is_unread"],
+                condition=models.Q(account=None),
+                name="unique_legacy_cube_cell",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.year}-{self.month:02d} {self.category or '-'} unread={self.is_unread}: {self.count}"
@@ -0,0 +1,179 @@
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+from .scheduler import QUOTA_COSTS
+from .services import execute_scheduled, fetch_messages_batched
+
+
+# ------------------------------------------------------------
+# Server-side review sessions with background prefetch
+# ------------------------------------------------------------
+# A session walks the mailbox with a list-page cursor and keeps the next
+# PREFETCH_PAGES pages of candidates fetched in the background, so the
+# "next page" click returns what is already in memory. Anything deleted
+# or kept (in any session) is dropped from every buffer before it can be
+# shown again.
+
+DEFAULT_QUERY = "is:unread"
+DEFAULT_PAGE_SIZE = 25
+PREFETCH_PAGES = 2
+SESSION_IDLE_SECONDS = 30 * 60
+FIRST_PAGE_TIMEOUT = 60
+
+
+def _candidate(msg):
+    headers = msg.get("payload", {}).get("headers", [])
+
+    def get_header(name):
+        return next((h["value"] for h in headers if h["name"] == name), "Unknown")
+
+    internal_dt = datetime.fromtimestamp(int(msg.get("internalDate", 0)) / 1000)
+    return {
+        "id": msg["id"],
+        "subject": get_header("Subject"),
+        "from": get_header("From"),
+        "date_human": internal_dt.strftime("%a, %d %b %Y %I:%M %p"),
+        "snippet": msg.get("snippet", ""),
+    }
+
+
+class ReviewSession:
+    def __init__(self, account=None, query=DEFAULT_QUERY, page_size=DEFAULT_PAGE_SIZE):
+        self.id = uuid.uuid4().hex
+        self.account = account
+        self.query = query
+        self.page_size = page_size
+        self.last_used = time.monotonic()
+
+        self._buffer = deque()
+        self._discarded = set()
+        self._cursor = None
+        self._exhausted = False
+        self._error = None
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._prefetching = False
+
+    @property
+    def exhausted(self):
+        with self._lock:
+            return self._exhausted and not self._buffer
+
+    def discard(self, message_ids):
+        """Drops deleted/reviewed messages from the prefetched buffer."""
+        with self._lock:
+            self._discarded.update(message_ids)
+            self._buffer = deque(c for c in self._buffer if c["id"] not in self._discarded)
+
+    def next_page(self):
+        """
+        Returns the next page of candidates. Only the very first call (or a
+        user who out-clicks the prefetcher) ever waits on Gmail.
+        Re-raises the prefetch error when it left nothing to show; the
+        next call retries.
+        """
+        self.last_used = time.monotonic()
+        self._start_prefetch()
+
+        with self._ready:
+            self._ready.wait_for(
+                lambda: len(self._buffer) >= self.page_size or self._exhausted or self._error,
+                timeout=FIRST_PAGE_TIMEOUT,
+            )
+            page = [self._buffer.popleft() for _ in range(min(self.page_size, len(self._buffer)))]
+            if not page and self._error is not None:
+                raise self._error
+
+        # Refill behind the page we just handed out
+        self._start_prefetch()
+        return page
+
+    def _start_prefetch(self):
+        with self._lock:
+            if self._prefetching or self._exhausted:
+                return
+            if len(self._buffer) >= self.page_size * PREFETCH_PAGES:
+                return
+            self._prefetching = True
+            self._error = None
+        threading.Thread(target=self._prefetch, daemon=True).start()
+
+    def _prefetch(self):
+        # Every call below is a job on the account's fair-scheduler queue
+        from .gmail_auth import authenticate_gmail
+
+        try:
+            service = authenticate_gmail(self.account)
+            while True:
+                with self._lock:
+                    if self._exhausted or len(self._buffer) >= self.page_size * PREFETCH_PAGES:
+                        break
+                    cursor = self._cursor
+
+                response = execute_scheduled(service, service.users().messages().list(
+                    userId="me",
+                    q=self.query,
+                    pageToken=cursor,
+                    maxResults=self.page_size,
+                    fields="nextPageToken,messages(id)"
+                ), cost=QUOTA_COSTS["messages.list"])
+                ids = [m["id"] for m in response.get("messages", [])]
+
+                candidates = [
+                    _candidate(msg)
+                    for _, msg in fetch_messages_batched(
+                        service, ids, format="metadata",
+                        fields="id,internalDate,snippet,payload/headers",
+                        metadata_headers=["Subject", "From"],
+                    )
+                    if msg
+                ]
+
+                with self._ready:
+                    self._buffer.extend(c for c in candidates if c["id"] not in self._discarded)
+                    self._cursor = response.get("nextPageToken")
+                    self._exhausted = not self._cursor
+                    self._ready.notify_all()
+        except Exception as e:
+            print(f"Review prefetch failed for session {self.id}: {e}")
+            with self._ready:
+                self._error = e
+                self._ready.notify_all()
+        finally:
+            with self._lock:
+                self._prefetching = False
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def create_session(account=None, query=DEFAULT_QUERY, page_size=DEFAULT_PAGE_SIZE):
+    session = ReviewSession(account=account, query=query, page_size=page_size)
+    with _sessions_lock:
+        _expire_sessions()
+        _sessions[session.id] = session
+    return session
+
+
+def get_session(session_id):
+    with _sessions_lock:
+        return _sessions.get(session_id)
+
+
+def discard_everywhere(message_ids):
+    """Called after deletes/keeps so no open session shows them again."""
+    message_ids = set(message_ids)
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+    for session in sessions:
+        session.discard(message_ids)
+
+
+def _expire_sessions():
+    cutoff = time.monotonic() - SESSION_IDLE_SECONDS
+    for session_id in [sid for sid, s in _sessions.items() if s.last_used < cutoff]:
+        del _sessions[session_id]
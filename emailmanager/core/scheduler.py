@@ -0,0 +1,230 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from django.conf import settings
+
+
+# ------------------------------------------------------------
+# Fair shared job scheduler for many mailboxes
+# ------------------------------------------------------------
+# One pool of worker threads serves every account. Jobs are queued per
+# account and workers take turns across accounts (round robin), so a
+# 200k-message purge on one mailbox can't starve a quick sync on another.
+#
+# Each account also has:
+#   - a token bucket refilled at its Gmail quota (units per second), and
+#     every job declares its quota cost up front
+#   - a cap on concurrently running jobs
+# An account that is out of quota or at its cap is skipped for that turn
+# rather than holding a worker hostage.
+#
+# Keep jobs small (one list page, one 50-message batch, one batchDelete)
+# so turns rotate quickly. Every Gmail call in core/ goes through here via
+# services.schedule()/execute_scheduled(), keyed by scheduler_key(service).
+
+# Gmail API quota units per call
+# https://developers.google.com/gmail/api/reference/quota
+QUOTA_COSTS = {
+    "messages.get": 5,
+    "messages.list": 5,
+    "messages.delete": 10,
+    "messages.trash": 5,
+    "messages.batchDelete": 50,
+    "history.list": 2,
+    "users.watch": 100,
+    "users.getProfile": 1,
+}
+
+DEFAULT_QUOTA_UNITS_PER_SECOND = 250
+DEFAULT_MAX_CONCURRENCY = 4
+
+# Queue for the single-mailbox token.json client
+LEGACY_KEY = "token.json"
+
+_worker_local = threading.local()
+
+
+class _TokenBucket:
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = rate  # allow up to one second of burst
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, cost):
+        self._refill()
+        # A job costing more than the whole bucket may run once it is full
+        cost = min(cost, self.capacity)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    def wait_time(self, cost):
+        self._refill()
+        return max(0.0, (min(cost, self.capacity) - self.tokens) / self.rate)
+
+
+class _AccountQueue:
+    def __init__(self, rate, max_concurrency):
+        self.jobs = deque()
+        self.bucket = _TokenBucket(rate)
+        self.max_concurrency = max_concurrency
+        self.running = 0
+
+
+class FairScheduler:
+    """
+    Round-robin, quota-aware scheduler shared by all accounts.
+
+        scheduler.configure_account("a@example.com", units_per_second=250)
+        future = scheduler.submit("a@example.com", fn, *args, cost=5)
+    """
+
+    def __init__(self, workers=8):
+        self._cond = threading.Condition()
+        self._accounts = {}
+        self._ring = deque()  # accounts with queued jobs, in turn order
+        self._shutdown = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"gmail-scheduler-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def configure_account(self, key, units_per_second=DEFAULT_QUOTA_UNITS_PER_SECOND,
+                          max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        with self._cond:
+            queue = self._accounts.get(key)
+            if queue is None:
+                self._accounts[key] = _AccountQueue(units_per_second, max_concurrency)
+            else:
+                queue.bucket.rate = queue.bucket.capacity = units_per_second
+                queue.max_concurrency = max_concurrency
+
+    def submit(self, key, fn, *args, cost=QUOTA_COSTS["messages.get"], **kwargs):
+        """Queues fn(*args, **kwargs) under account `key`. Returns a Future."""
+        future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("Scheduler has been shut down")
+            if key not in self._accounts:
+                self._accounts[key] = _AccountQueue(DEFAULT_QUOTA_UNITS_PER_SECOND, DEFAULT_MAX_CONCURRENCY)
+            queue = self._accounts[key]
+
+            if getattr(_worker_local, "scheduler", None) is self:
+                # A job submitting (and then waiting on) another job could
+                # tie up every worker; run it inline and charge the quota
+                # as debt so the account still slows down.
+                queue.bucket.tokens -= min(cost, queue.bucket.capacity)
+                inline = True
+            else:
+                queue.jobs.append((future, fn, args, kwargs, cost))
+                inline = False
+            if not inline:
+                if key not in self._ring:
+                    self._ring.append(key)
+                self._cond.notify()
+
+        if inline:
+            self._run(future, fn, args, kwargs)
+        return future
+
+    def _next_job(self):
+        """
+        Picks the next runnable job, rotating through accounts. Returns
+        (key, job) or (None, seconds_to_wait). Caller holds the lock.
+        """
+        wait = None
+        for _ in range(len(self._ring)):
+            key = self._ring[0]
+            self._ring.rotate(-1)
+            queue = self._accounts[key]
+
+            if queue.running >= queue.max_concurrency:
+                continue
+
+            cost = queue.jobs[0][4]
+            if not queue.bucket.try_take(cost):
+                account_wait = queue.bucket.wait_time(cost)
+                wait = account_wait if wait is None else min(wait, account_wait)
+                continue
+
+            job = queue.jobs.popleft()
+            if not queue.jobs:
+                self._ring.remove(key)
+            queue.running += 1
+            return key, job
+
+        return None, wait
+
+    @staticmethod
+    def _run(future, fn, args, kwargs):
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def _worker(self):
+        _worker_local.scheduler = self
+        while True:
+            with self._cond:
+                while True:
+                    if self._shutdown and not self._ring:
+                        return
+                    key, job = self._next_job()
+                    if key is not None:
+                        break
+                    self._cond.wait(timeout=job)
+
+            future, fn, args, kwargs, cost = job
+            self._run(future, fn, args, kwargs)
+
+            with self._cond:
+                self._accounts[key].running -= 1
+                self._cond.notify_all()
+
+    def shutdown(self, wait=True):
+        """Stops accepting jobs; workers exit once the queues drain."""
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+def scheduler_key(service):
+    """The account queue a Gmail client's calls are charged to."""
+    key = getattr(service, "scheduler_key", None)
+    return key if isinstance(key, str) else LEGACY_KEY
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """The process-wide scheduler, with limits loaded from GmailAccount rows."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            from .models import GmailAccount
+
+            _scheduler = FairScheduler(workers=settings.GMAIL_SCHEDULER_WORKERS)
+            for account in GmailAccount.objects.filter(is_active=True):
+                _scheduler.configure_account(
+                    account.email_address,
+                    units_per_second=account.quota_units_per_second,
+                    max_concurrency=account.max_concurrency,
+                )
+        return _scheduler
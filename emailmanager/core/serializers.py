@@ -1,5 +1,54 @@
+from datetime import datetime
+
 from rest_framework import serializers
 
+from .review import DEFAULT_PAGE_SIZE, DEFAULT_QUERY
+
 
 class DeleteOldEmailsSerializer(serializers.Serializer):
     days_old = serializers.IntegerField(min_value=1)
+
+
+class ProposedDeletionsSerializer(serializers.Serializer):
+    threshold = serializers.FloatField(min_value=0.0, max_value=1.0, default=0.9)
+    limit = serializers.IntegerField(min_value=1, max_value=5000, default=1000)
+
+
+class ClusterListSerializer(serializers.Serializer):
+    min_size = serializers.IntegerField(min_value=2, default=2)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=200)
+
+
+class MailboxCubeRefreshSerializer(serializers.Serializer):
+    source = serializers.ChoiceField(choices=["index", "estimate"], default="index")
+    # Gmail launched in 2004
+    from_year = serializers.IntegerField(min_value=2004, default=2010)
+    to_year = serializers.IntegerField(min_value=2004, required=False)
+
+    def validate(self, data):
+        this_year = datetime.now().year
+        to_year = data.get("to_year", this_year)
+        if data["from_year"] > this_year or to_year > this_year:
+            raise serializers.ValidationError("Years can't be in the future.")
+        if to_year < data["from_year"]:
+            raise serializers.ValidationError({"to_year": "to_year must not be before from_year."})
+        return data
+
+
+class ReviewSessionSerializer(serializers.Serializer):
+    query = serializers.CharField(required=False, allow_blank=True, default=DEFAULT_QUERY)
+    page_size = serializers.IntegerField(min_value=1, max_value=100, default=DEFAULT_PAGE_SIZE)
+
+
+class LargestMessagesSerializer(serializers.Serializer):
+    k = serializers.IntegerField(min_value=1, max_value=5000, default=500)
+    q = serializers.CharField(required=False, allow_blank=True, default="")
+    source = serializers.ChoiceField(choices=["index", "gmail"], default="index")
+
+    def validate(self, data):
+        # A live scan fetches every matching message inside the request
+        if data["source"] == "gmail" and not data["q"].strip():
+            raise serializers.ValidationError(
+                {"q": "A search query is required with source=gmail; use source=index for the whole mailbox."}
+            )
+        return data
@@ -1,9 +1,14 @@
 from datetime import datetime, timedelta
+import heapq
 import time
+import threading
+from collections import defaultdict, deque
 from email.utils import parsedate_to_datetime
 
 from django.http import JsonResponse
 
+from .scheduler import QUOTA_COSTS, get_scheduler, scheduler_key
+
 
 # ------------------------------------------------------------
 # Test Authentication (mirrors FastAPI behavior exactly)
@@ -90,6 +95,7 @@ def list_recent_unread_emails(service, days=30):
                 parsed_date = datetime.fromtimestamp(internal_ms / 1000)
 
             email_list.append({
+                "id": message["id"],
                 "from": from_email,
                 "subject": subject,
                 "date": parsed_date if isinstance(parsed_date, str) else parsed_date.isoformat()
@@ -263,8 +269,324 @@ def delete_old_unread_emails(service):
 
 
 
+# ------------------------------------------------------------
+# Batched message fetching (shared by export / reporting code)
+# ------------------------------------------------------------
+# Gmail accepts up to 100 calls per batch but starts rate limiting
+# well before that, so 50 is the documented sweet spot.
+GMAIL_BATCH_SIZE = 50
+GMAIL_BATCH_RETRIES = 3
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+_thread_local = threading.local()
+
+
+def thread_http(service):
+    """
+    Returns an authorized http object the calling thread may use.
+    httplib2 connections are not thread-safe, so each worker gets its own.
+    The cache holds one connection per account (scheduler_key) per thread,
+    replaced (and closed) when the client's credentials change, so
+    long-lived scheduler workers don't pile up a connection per request.
+    A thread-safe pooled transport is simply shared.
+    """
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+
+    if getattr(service._http, "thread_safe", False):
+        return service._http
+
+    credentials = service._http.credentials
+    cache = getattr(_thread_local, "http_by_account", None)
+    if cache is None:
+        cache = _thread_local.http_by_account = {}
+
+    key = scheduler_key(service)
+    http = cache.get(key)
+    if http is None or http.credentials is not credentials:
+        if http is not None:
+            http.http.close()
+        http = cache[key] = AuthorizedHttp(credentials, http=httplib2.Http())
+    return http
+
+
+def schedule(service, fn, *args, cost, **kwargs):
+    """
+    Queues fn(*args, **kwargs) on the shared fair scheduler, charged to
+    the client's account. Returns a Future.
+    """
+    return get_scheduler().submit(scheduler_key(service), fn, *args, cost=cost, **kwargs)
+
+
+def execute_scheduled(service, request, cost):
+    """Runs one API request as a scheduler job and waits for the response."""
+    return schedule(service, lambda: request.execute(http=thread_http(service)), cost=cost).result()
+
+
+def _fetch_batch(service, ids, get_kwargs):
+    """
+    Fetches one chunk of messages with a single batched HTTP request.
+    Sub-requests that hit rate limits or 5xx errors are retried with
+    backoff; anything still failing comes back as None.
+    """
+    results = {}
+    pending = list(ids)
+
+    for attempt in range(GMAIL_BATCH_RETRIES):
+        retry = []
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                results[request_id] = response
+                return
+            status = getattr(getattr(exception, "resp", None), "status", None)
+            if status in RETRYABLE_STATUSES:
+                retry.append(request_id)
+            else:
+                print(f"Error fetching message {request_id}: {exception}")
+
+        batch = service.new_batch_http_request(callback=callback)
+        for msg_id in pending:
+            batch.add(
+                service.users().messages().get(userId="me", id=msg_id, **get_kwargs),
+                request_id=msg_id
+            )
+        batch.execute(http=thread_http(service))
+
+        if not retry:
+            break
+        pending = retry
+        time.sleep(2 ** attempt)
+    else:
+        print(f"Giving up on {len(pending)} messages after {GMAIL_BATCH_RETRIES} attempts.")
+
+    return [(msg_id, results.get(msg_id)) for msg_id in ids]
+
+
+def fetch_messages_batched(service, message_ids, format="metadata", fields=None,
+                           metadata_headers=None, batch_size=GMAIL_BATCH_SIZE, workers=4):
+    """
+    Yields (message_id, message) pairs in input order, `batch_size` messages
+    per HTTP round trip, with up to `workers` batches queued on the fair
+    scheduler at once (each charged batch_size x messages.get).
+
+    `message_ids` may be any iterable (including a generator over list
+    pages). Only `workers` batches are ever held in memory, so this is safe
+    to run over an entire mailbox. `message` is None if the fetch failed.
+    """
+    get_kwargs = {"format": format}
+    if fields:
+        get_kwargs["fields"] = fields
+    if metadata_headers:
+        get_kwargs["metadataHeaders"] = metadata_headers
+
+    def chunks():
+        chunk = []
+        for msg_id in message_ids:
+            chunk.append(msg_id)
+            if len(chunk) >= batch_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    in_flight = deque()
+    try:
+        for chunk in chunks():
+            in_flight.append(schedule(
+                service, _fetch_batch, service, chunk, get_kwargs,
+                cost=QUOTA_COSTS["messages.get"] * len(chunk)
+            ))
+            if len(in_flight) >= workers:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+    finally:
+        # Caller stopped early: don't spend quota on batches nobody reads
+        for future in in_flight:
+            future.cancel()
+
+
+
+def iter_message_ids(service, query="", page_size=500):
+    """
+    Yields every message ID matching `query`, one list page at a time.
+    Only IDs are requested, so this is the cheapest way to walk a mailbox.
+    """
+    next_page = None
+    while True:
+        results = execute_scheduled(service, service.users().messages().list(
+            userId="me",
+            q=query,
+            pageToken=next_page,
+            maxResults=page_size,
+            fields="nextPageToken,messages(id)"
+        ), cost=QUOTA_COSTS["messages.list"])
+
+        for msg in results.get("messages", []):
+            yield msg["id"]
+
+        next_page = results.get("nextPageToken")
+        if not next_page:
+            break
+
+
+def batch_delete_messages(service, message_ids):
+    """
+    Permanently deletes any number of messages.
+    batchDelete takes at most 1000 IDs per call, so we chunk.
+    """
+    message_ids = list(message_ids)
+    for start in range(0, len(message_ids), 1000):
+        execute_scheduled(service, service.users().messages().batchDelete(
+            userId="me",
+            body={"ids": message_ids[start:start + 1000]}
+        ), cost=QUOTA_COSTS["messages.batchDelete"])
+    return len(message_ids)
+
+
+# ------------------------------------------------------------
+# Storage reclaim: largest messages / threads
+# ------------------------------------------------------------
+def find_largest_messages(service, k=500, query="", workers=4):
+    """
+    Streams through every message matching `query` and keeps the K largest
+    messages (by sizeEstimate) in a bounded min-heap.
+
+    Also totals bytes per thread, per sender and per year. Those totals are
+    NOT bounded: memory grows with the number of distinct threads and
+    senders matched, and the scan costs one messages.get per message. Keep
+    `query` narrow, or use find_largest_in_index() for the whole mailbox.
+    Returns a dict whose "ids" can be sent straight to the batch-delete
+    endpoint.
+    """
+    heap = []  # (size, id, entry) -- smallest of the top K sits at heap[0]
+    thread_sizes = defaultdict(lambda: [0, 0])  # threadId -> [bytes, count]
+    sender_sizes = defaultdict(lambda: [0, 0])
+    year_sizes = defaultdict(lambda: [0, 0])
+    scanned = 0
+    total_bytes = 0
+
+    for msg_id, msg in fetch_messages_batched(
+        service,
+        iter_message_ids(service, query),
+        format="metadata",
+        fields="id,threadId,sizeEstimate,internalDate,payload/headers",
+        metadata_headers=["From", "Subject"],
+        workers=workers,
+    ):
+        if not msg:
+            continue
+
+        size = int(msg.get("sizeEstimate", 0))
+        scanned += 1
+        total_bytes += size
+
+        headers = msg.get("payload", {}).get("headers", [])
+        frm = next((h["value"] for h in headers if h["name"] == "From"), "Unknown Sender")
+        subject = next((h["value"] for h in headers if h["name"] == "Subject"), "No Subject")
+        internal_dt = datetime.fromtimestamp(int(msg.get("internalDate", 0)) / 1000)
+
+        for bucket, key in (
+            (thread_sizes, msg.get("threadId", msg_id)),
+            (sender_sizes, frm),
+            (year_sizes, internal_dt.year),
+        ):
+            bucket[key][0] += size
+            bucket[key][1] += 1
+
+        if len(heap) < k or size > heap[0][0]:
+            entry = {
+                "id": msg_id,
+                "thread_id": msg.get("threadId"),
+                "from": frm,
+                "subject": subject,
+                "date_human": internal_dt.strftime("%a, %d %b %Y %I:%M %p"),
+                "size": size,
+            }
+            if len(heap) < k:
+                heapq.heappush(heap, (size, msg_id, entry))
+            else:
+                heapq.heappushpop(heap, (size, msg_id, entry))
+
+    largest = [entry for _, _, entry in sorted(heap, reverse=True)]
+
+    def top(bucket, key_name, n):
+        rows = heapq.nlargest(n, bucket.items(), key=lambda item: item[1][0])
+        return [{key_name: key, "bytes": b, "count": c} for key, (b, c) in rows]
+
+    return {
+        "messages": largest,
+        "ids": [entry["id"] for entry in largest],
+        "threads": top(thread_sizes, "thread_id", k),
+        "by_sender": top(sender_sizes, "from", 50),
+        "by_year": sorted(
+            ({"year": y, "bytes": b, "count": c} for y, (b, c) in year_sizes.items()),
+            key=lambda row: row["year"]
+        ),
+        "scanned": scanned,
+        "total_bytes": total_bytes,
+        "source": "gmail",
+    }
+
+
+def find_largest_in_index(account=None, k=500):
+    """
+    Same report as find_largest_messages(), computed from the local index
+    with a few ORDER BY / GROUP BY queries: no Gmail calls, and nothing
+    bigger than K rows is ever loaded.
+    """
+    from django.db.models import Count, Sum
+    from django.db.models.functions import ExtractYear
+
+    from .models import Message
+
+    messages = Message.objects.filter(account=account)
+
+    largest = [
+        {
+            "id": m.gmail_id,
+            "thread_id": m.thread_id,
+            "from": m.sender,
+            "subject": m.subject,
+            "date_human": m.internal_date.strftime("%a, %d %b %Y %I:%M %p") if m.internal_date else "",
+            "size": m.size_estimate,
+        }
+        for m in messages.order_by("-size_estimate")[:k]
+    ]
+
+    def top(field, key_name, n):
+        rows = (
+            messages.values(field)
+            .annotate(bytes=Sum("size_estimate"), count=Count("id"))
+            .order_by("-bytes")[:n]
+        )
+        return [{key_name: row[field], "bytes": row["bytes"], "count": row["count"]} for row in rows]
+
+    by_year = (
+        messages.exclude(internal_date=None)
+        .annotate(year=ExtractYear("internal_date"))
+        .values("year")
+        .annotate(bytes=Sum("size_estimate"), count=Count("id"))
+        .order_by("year")
+    )
+    totals = messages.aggregate(scanned=Count("id"), total_bytes=Sum("size_estimate"))
+
+    return {
+        "messages": largest,
+        "ids": [entry["id"] for entry in largest],
+        "threads": top("thread_id", "thread_id", k),
+        "by_sender": top("sender", "from", 50),
+        "by_year": [{"year": r["year"], "bytes": r["bytes"], "count": r["count"]} for r in by_year],
+        "scanned": totals["scanned"],
+        "total_bytes": totals["total_bytes"] or 0,
+        "source": "index",
+    }
+
+
 ## Mass Deletion by category
-def mass_delete_promotions(service, year, category='promotions', limit=None, dry_run=False):
+def mass_delete_promotions(service, year, category='promotions', limit=None, dry_run=False,
+                           archive_path=None, archive_compression="gzip"):
     """
     Deletes ALL unread emails in a specific category for a specific year.
     
@@ -272,6 +594,10 @@ def mass_delete_promotions(service, year, category='promotions', limit=None, dry
         year (int): The year to target (e.g., 2018).
         category (str): 'promotions', 'social', 'updates', or 'primary'.
         limit (int): Optional safety cap (e.g., stop after 5000 deletions).
+        archive_path (str): If set, every batch is exported to this compressed
+                            mbox first, and only messages that made it into
+                            the archive are deleted.
+        archive_compression (str): 'gzip' or 'zstd'.
     """
     # 1. Build the specific date range for that year
     start_date = f"{year}/01/01"
@@ -284,59 +610,94 @@ def mass_delete_promotions(service, year, category='promotions', limit=None, dry
 
     total_deleted = 0
     next_page = None
+    archive = _open_archive(archive_path, archive_compression)
     
-    while True:
-        # Check safety limit
-        if limit and total_deleted >= limit:
-            print(f"Reached safety limit of {limit}. Stopping.")
-            break
+    try:
+        while True:
+            # Check safety limit
+            if limit and total_deleted >= limit:
+                print(f"Reached safety limit of {limit}. Stopping.")
+                break
 
-        # 2. Fetch IDs only (lightweight)
-        # batchDelete only accepts 1000 IDs at a time, so we fetch 1000 max.
-        results = service.users().messages().list(
-            userId="me",
-            q=query,
-            pageToken=next_page,
-            maxResults=1000, 
-            fields="nextPageToken,messages(id)"
-        ).execute()
+            # 2. Fetch IDs only (lightweight)
+            # batchDelete only accepts 1000 IDs at a time, so we fetch 1000 max.
+            results = execute_scheduled(service, service.users().messages().list(
+                userId="me",
+                q=query,
+                pageToken=next_page,
+                maxResults=1000, 
+                fields="nextPageToken,messages(id)"
+            ), cost=QUOTA_COSTS["messages.list"])
 
-        messages = results.get("messages", [])
+            messages = results.get("messages", [])
         
-        if not messages:
-            print("No more messages found matching criteria!")
-            break
+            if not messages:
+                print("No more messages found matching criteria!")
+                break
+
+            # 3. Extract IDs for the batch
+            batch_ids = [msg['id'] for msg in messages]
 
-        # 3. Extract IDs for the batch
-        batch_ids = [msg['id'] for msg in messages]
+            # 3b. Archive before anything is destroyed
+            if archive:
+                batch_ids = _archive_batch(service, archive, batch_ids)
+                if not batch_ids:
+                    print("Nothing in this batch could be archived. Stopping.")
+                    break
         
-        # 4. EXECUTE BATCH DELETE
-        print(f"Deleting batch of {len(batch_ids)} emails...")
-        try:
-            service.users().messages().batchDelete(
-                userId="me",
-                body={"ids": batch_ids}
-            ).execute()
+            # 4. EXECUTE BATCH DELETE
+            print(f"Deleting batch of {len(batch_ids)} emails...")
+            try:
+                execute_scheduled(service, service.users().messages().batchDelete(
+                    userId="me",
+                    body={"ids": batch_ids}
+                ), cost=QUOTA_COSTS["messages.batchDelete"])
             
-            total_deleted += len(batch_ids)
-            print(f"Total deleted so far: {total_deleted}")
+                total_deleted += len(batch_ids)
+                print(f"Total deleted so far: {total_deleted}")
             
-        except Exception as e:
-            print(f"Error during batch delete: {e}")
-            break
+            except Exception as e:
+                print(f"Error during batch delete: {e}")
+                break
 
-        # 5. Check if there are more pages
-        next_page = results.get("nextPageToken")
-        if not next_page:
-            break
+            # 5. Check if there are more pages
+            next_page = results.get("nextPageToken")
+            if not next_page:
+                break
             
-        # Optional: Sleep briefly to be nice to the API
-        time.sleep(0.5)
+            # Optional: Sleep briefly to be nice to the API
+            time.sleep(0.5)
+    finally:
+        if archive:
+            archive.close()
+            print(f"Archived to {archive_path}")
 
     print(f"--- DONE. Deleted {total_deleted} emails from {year}. ---")
     return total_deleted
 
 
+def _open_archive(archive_path, compression):
+    if not archive_path:
+        return None
+    from .archive import MboxArchiveWriter
+    return MboxArchiveWriter(archive_path, compression=compression)
+
+
+def _archive_batch(service, archive, batch_ids):
+    """
+    Exports a batch to the open archive and returns the IDs that were
+    written. Anything that failed to download is left out so it is never
+    deleted without a copy.
+    """
+    from .archive import export_messages
+
+    archived = export_messages(service, batch_ids, archive)
+    skipped = len(batch_ids) - len(archived)
+    if skipped:
+        print(f"Skipping {skipped} messages that could not be archived.")
+    return archived
+
+
 def batch_trash_emails(service, message_ids):
     """
     Moves a list of message IDs to the Trash efficiently.
@@ -372,7 +733,8 @@ import time
 from collections import Counter
 
 # Make sure 'dry_run' is in this line:
-def mass_delete_emails(service, year, category='promotions', limit=None, dry_run=True):
+def mass_delete_emails(service, year, category='promotions', limit=None, dry_run=True,
+                       archive_path=None, archive_compression="gzip"):
     
     # 1. Build Query
     start_date = f"{year}/01/01"
@@ -389,83 +751,95 @@ def mass_delete_emails(service, year, category='promotions', limit=None, dry_run
     
     total_processed = 0
     next_page = None
+    archive = None if dry_run else _open_archive(archive_path, archive_compression)
     
-    while True:
-        # Check global limit
-        if limit and total_processed >= limit:
-            print(f"Reached limit of {limit}.")
-            break
+    try:
+        while True:
+            # Check global limit
+            if limit and total_processed >= limit:
+                print(f"Reached limit of {limit}.")
+                break
 
-        # 2. Fetch IDs
-        results = service.users().messages().list(
-            userId="me",
-            q=query,
-            pageToken=next_page,
-            maxResults=fetch_limit, 
-            fields="nextPageToken,messages(id)"
-        ).execute()
+            # 2. Fetch IDs
+            results = execute_scheduled(service, service.users().messages().list(
+                userId="me",
+                q=query,
+                pageToken=next_page,
+                maxResults=fetch_limit, 
+                fields="nextPageToken,messages(id)"
+            ), cost=QUOTA_COSTS["messages.list"])
 
-        messages = results.get("messages", [])
+            messages = results.get("messages", [])
         
-        if not messages:
-            print("No emails found matching criteria.")
-            break
+            if not messages:
+                print("No emails found matching criteria.")
+                break
 
-        # --- DRY RUN LOGIC ---
-        if dry_run:
-            print(f"Analyzing sample of {len(messages)} emails...")
-            senders = []
-            subjects = []
+            # --- DRY RUN LOGIC ---
+            if dry_run:
+                print(f"Analyzing sample of {len(messages)} emails...")
+                senders = []
+                subjects = []
             
-            for msg in messages:
-                # We need to fetch headers to see the Sender
-                meta = service.users().messages().get(
-                    userId="me", id=msg['id'], format="metadata", 
-                    metadataHeaders=['From', 'Subject']
-                ).execute()
+                for _, meta in fetch_messages_batched(
+                    service, [msg['id'] for msg in messages], format="metadata",
+                    metadata_headers=['From', 'Subject']
+                ):
+                    # We need to fetch headers to see the Sender
+                    if not meta:
+                        continue
                 
-                headers = meta['payload']['headers']
-                frm = next((h['value'] for h in headers if h['name'] == 'From'), "Unknown")
-                sub = next((h['value'] for h in headers if h['name'] == 'Subject'), "No Subject")
+                    headers = meta['payload']['headers']
+                    frm = next((h['value'] for h in headers if h['name'] == 'From'), "Unknown")
+                    sub = next((h['value'] for h in headers if h['name'] == 'Subject'), "No Subject")
                 
-                # Clean up sender name
-                sender_name = frm.split('<')[0].strip().replace('"', '')
-                senders.append(sender_name)
-                subjects.append(f"{sender_name}: {sub[:30]}...")
-
-            print(f"\n--- SENDER REPORT ({year}) ---")
-            for name, count in Counter(senders).most_common(10):
-                print(f"{count}x  From: {name}")
+                    # Clean up sender name
+                    sender_name = frm.split('<')[0].strip().replace('"', '')
+                    senders.append(sender_name)
+                    subjects.append(f"{sender_name}: {sub[:30]}...")
+
+                print(f"\n--- SENDER REPORT ({year}) ---")
+                for name, count in Counter(senders).most_common(10):
+                    print(f"{count}x  From: {name}")
             
-            print("\n--- SAMPLE SUBJECTS ---")
-            for s in subjects[:5]:
-                print(f" - {s}")
+                print("\n--- SAMPLE SUBJECTS ---")
+                for s in subjects[:5]:
+                    print(f" - {s}")
                 
-            print(f"\n[!] Dry Run Complete. To delete, run with dry_run=False")
-            return 0 # Stop here
+                print(f"\n[!] Dry Run Complete. To delete, run with dry_run=False")
+                return 0 # Stop here
 
-        # --- DELETION LOGIC (Using Trash) ---
-        else:
-            # Use the permanent batchDelete OR the batch_trash helper we made
-            batch_ids = [msg['id'] for msg in messages]
-            print(f"Deleting batch of {len(batch_ids)} emails...")
+            # --- DELETION LOGIC (Using Trash) ---
+            else:
+                # Use the permanent batchDelete OR the batch_trash helper we made
+                batch_ids = [msg['id'] for msg in messages]
+                if archive:
+                    batch_ids = _archive_batch(service, archive, batch_ids)
+                    if not batch_ids:
+                        print("Nothing in this batch could be archived. Stopping.")
+                        break
+                print(f"Deleting batch of {len(batch_ids)} emails...")
             
-            try:
-                service.users().messages().batchDelete(
-                    userId="me",
-                    body={"ids": batch_ids}
-                ).execute()
+                try:
+                    execute_scheduled(service, service.users().messages().batchDelete(
+                        userId="me",
+                        body={"ids": batch_ids}
+                    ), cost=QUOTA_COSTS["messages.batchDelete"])
                 
-                total_processed += len(batch_ids)
-                print(f"Total deleted so far: {total_processed}")
-            except Exception as e:
-                print(f"Error: {e}")
-                break
+                    total_processed += len(batch_ids)
+                    print(f"Total deleted so far: {total_processed}")
+                except Exception as e:
+                    print(f"Error: {e}")
+                    break
 
-        next_page = results.get("nextPageToken")
-        if not next_page:
-            break
+            next_page = results.get("nextPageToken")
+            if not next_page:
+                break
             
-        time.sleep(1) # Safety pause
+            time.sleep(1) # Safety pause
+    finally:
+        if archive:
+            archive.close()
+            print(f"Archived to {archive_path}")
 
-    return total_processed
\ No newline at end of file
+    return total_processed
@@ -0,0 +1,343 @@
+import threading
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.utils import timezone as django_timezone
+
+from .models import Message, SyncState
+from .review import discard_everywhere
+from .scheduler import QUOTA_COSTS
+from .services import execute_scheduled, fetch_messages_batched, iter_message_ids
+
+
+# ------------------------------------------------------------
+# Gmail push (users().watch) + history-delta sync
+# ------------------------------------------------------------
+# Flow:
+#   1. start_watch() registers a Pub/Sub topic for the mailbox.
+#   2. Pub/Sub POSTs to /api/gmail/push/ on every mailbox change.
+#   3. The webhook hands the notification to push_debouncer, which
+#      coalesces a burst of notifications into a single sync.
+#   4. sync_history() fetches only the history since the last sync and
+#      updates the local Message index.
+#
+# backfill_index() builds the index from scratch (the index_mailbox
+# command); it is also the fallback when Gmail has expired our history ID.
+
+HISTORY_TYPES = ["messageAdded", "messageDeleted", "labelAdded", "labelRemoved"]
+INDEX_HEADERS = ["From", "Subject"]
+INDEX_FIELDS = "id,threadId,labelIds,snippet,sizeEstimate,internalDate,payload/headers"
+
+# IDs handed to index_messages() at a time during a backfill
+BACKFILL_CHUNK = 500
+
+
+def message_fields(msg):
+    """Maps a metadata-format Gmail message onto Message model fields."""
+    headers = msg.get("payload", {}).get("headers", [])
+    label_ids = msg.get("labelIds", [])
+    category = next(
+        (label[len("CATEGORY_"):].lower() for label in label_ids if label.startswith("CATEGORY_")),
+        ""
+    )
+    internal_ms = int(msg.get("internalDate", 0))
+
+    return {
+        "thread_id": msg.get("threadId", ""),
+        "sender": next((h["value"] for h in headers if h["name"] == "From"), "Unknown Sender"),
+        "subject": next((h["value"] for h in headers if h["name"] == "Subject"), "No Subject"),
+        "snippet": msg.get("snippet", ""),
+        "label_ids": label_ids,
+        "category": category,
+        "is_unread": "UNREAD" in label_ids,
+        "size_estimate": int(msg.get("sizeEstimate", 0)),
+        "internal_date": datetime.fromtimestamp(internal_ms / 1000, tz=timezone.utc) if internal_ms else None,
+    }
+
+
+def index_messages(service, message_ids, account=None):
+    """
+    Fetches metadata for `message_ids` (batched), upserts them into the
+    local index under `account` and scores them. Returns the number of
+    messages indexed.
+    """
+    from .classifier import OnlineClassifier, score_messages
+
+    indexed = []
+    for msg_id, msg in fetch_messages_batched(
+        service, message_ids, format="metadata",
+        fields=INDEX_FIELDS, metadata_headers=INDEX_HEADERS
+    ):
+        if not msg:
+            continue
+        Message.objects.update_or_create(
+            account=account, gmail_id=msg_id, defaults=message_fields(msg)
+        )
+        indexed.append(msg_id)
+
+    # Classify new mail as soon as it lands in the index
+    score_messages(
+        Message.objects.filter(account=account, gmail_id__in=indexed),
+        OnlineClassifier.load(account),
+    )
+    return len(indexed)
+
+
+def backfill_index(service, account=None, query=""):
+    """
+    Indexes every message matching `query` (the whole mailbox by default)
+    and, for a full backfill, drops index rows for messages that no longer
+    exist. The history ID is read before listing starts, so the push sync
+    picks up anything that changes mid-backfill. Returns the number of
+    messages indexed.
+    """
+    profile = execute_scheduled(
+        service, service.users().getProfile(userId="me"), cost=QUOTA_COSTS["users.getProfile"]
+    )
+    history_id = int(profile["historyId"])
+    started = django_timezone.now()
+
+    indexed = listed = 0
+    chunk = []
+    for msg_id in iter_message_ids(service, query):
+        chunk.append(msg_id)
+        if len(chunk) >= BACKFILL_CHUNK:
+            indexed += index_messages(service, chunk, account=account)
+            listed += len(chunk)
+            chunk = []
+            print(f"Indexed {indexed} messages for {profile['emailAddress']}...")
+    if chunk:
+        indexed += index_messages(service, chunk, account=account)
+        listed += len(chunk)
+
+    if not query:
+        if indexed < listed:
+            # Rows we couldn't refresh might still exist in Gmail; keep them
+            print(f"{listed - indexed} messages failed to index; skipping stale-row cleanup.")
+        else:
+            stale, _ = Message.objects.filter(account=account, indexed_at__lt=started).delete()
+            if stale:
+                print(f"Dropped {stale} messages that are no longer in the mailbox.")
+
+    state = _sync_state(profile["emailAddress"], account)
+    state.history_id = history_id
+    state.save()
+
+    print(f"Backfilled {profile['emailAddress']}: {indexed} messages, history {history_id}")
+    return indexed
+
+
+def _sync_state(email_address, account):
+    state, _ = SyncState.objects.get_or_create(email_address=email_address)
+    if state.legacy != (account is None):
+        state.legacy = account is None
+        state.save(update_fields=["legacy", "updated_at"])
+    return state
+
+
+def start_watch(service, topic=None, label_ids=None, account=None):
+    """
+    Registers (or renews) push notifications for the mailbox.
+    Needs to be re-run at least every 7 days. account=None marks the
+    mailbox as the token.json one.
+    """
+    topic = topic or settings.GMAIL_PUSH_TOPIC
+    if not topic:
+        raise ValueError("No Pub/Sub topic configured (set GMAIL_PUSH_TOPIC)")
+
+    body = {"topicName": topic}
+    if label_ids:
+        body["labelIds"] = label_ids
+        body["labelFilterBehavior"] = "include"
+
+    response = execute_scheduled(
+        service, service.users().watch(userId="me", body=body), cost=QUOTA_COSTS["users.watch"]
+    )
+    profile = execute_scheduled(
+        service, service.users().getProfile(userId="me"), cost=QUOTA_COSTS["users.getProfile"]
+    )
+
+    state = _sync_state(profile["emailAddress"], account)
+    if state.history_id is None:
+        state.history_id = int(response["historyId"])
+    state.watch_expiration = datetime.fromtimestamp(
+        int(response["expiration"]) / 1000, tz=timezone.utc
+    )
+    state.save()
+
+    print(f"Watching {state.email_address} via {topic} until {state.watch_expiration}")
+    return state
+
+
+def sync_history(service, state, account=None):
+    """
+    Applies every mailbox change since `state.history_id` to the local
+    index: new messages are fetched and indexed, deleted ones removed, and
+    label changes applied in place. Returns a small summary dict.
+
+    Gmail only keeps about a week of history; if `state.history_id` has
+    expired (404) the index is rebuilt with backfill_index() instead.
+    """
+    added, deleted = set(), set()
+    labels = {}
+    next_page = None
+    latest_history_id = state.history_id
+
+    while True:
+        try:
+            response = execute_scheduled(service, service.users().history().list(
+                userId="me",
+                startHistoryId=state.history_id,
+                historyTypes=HISTORY_TYPES,
+                pageToken=next_page,
+                maxResults=500
+            ), cost=QUOTA_COSTS["history.list"])
+        except Exception as e:
+            if getattr(getattr(e, "resp", None), "status", None) != 404:
+                raise
+            print(f"History {state.history_id} for {state.email_address} has expired; resyncing.")
+            indexed = backfill_index(service, account=account)
+            state.refresh_from_db()
+            return {"added": indexed, "deleted": 0, "relabelled": 0, "resynced": True}
+
+        for record in response.get("history", []):
+            for item in record.get("messagesAdded", []):
+                added.add(item["message"]["id"])
+                deleted.discard(item["message"]["id"])
+            for item in record.get("messagesDeleted", []):
+                deleted.add(item["message"]["id"])
+                added.discard(item["message"]["id"])
+            for key in ("labelsAdded", "labelsRemoved"):
+                for item in record.get(key, []):
+                    labels[item["message"]["id"]] = item["message"].get("labelIds", [])
+
+        latest_history_id = int(response.get("historyId", latest_history_id))
+        next_page = response.get("nextPageToken")
+        if not next_page:
+            break
+
+    indexed = index_messages(service, sorted(added), account=account) if added else 0
+    messages = Message.objects.filter(account=account)
+    messages.filter(gmail_id__in=deleted).delete()
+    if deleted:
+        # Deleted elsewhere (phone, web UI): don't offer them for review
+        discard_everywhere(deleted)
+
+    relabelled = 0
+    for msg_id, label_ids in labels.items():
+        if msg_id in added or msg_id in deleted:
+            continue
+        relabelled += messages.filter(gmail_id=msg_id).update(
+            label_ids=label_ids, is_unread="UNREAD" in label_ids
+        )
+
+    state.history_id = latest_history_id
+    state.save(update_fields=["history_id", "updated_at"])
+
+    print(f"Synced {state.email_address}: +{indexed} -{len(deleted)} ~{relabelled}")
+    return {"added": indexed, "deleted": len(deleted), "relabelled": relabelled}
+
+
+def watched_mailbox(email_address):
+    """
+    Returns (account, state) if `email_address` is a mailbox we sync: an
+    active GmailAccount, or the mailbox gmail_watch registered for
+    token.json (account is None). Returns None for anything else, including
+    deactivated accounts whose watch hasn't expired yet.
+    """
+    from .models import GmailAccount
+
+    account = GmailAccount.objects.filter(email_address=email_address).first()
+    if account is not None:
+        if not account.is_active:
+            return None
+        return account, _sync_state(email_address, account)
+
+    state = SyncState.objects.filter(email_address=email_address, legacy=True).first()
+    if state is None:
+        return None
+    return None, state
+
+
+def sync_mailbox(email_address, history_id):
+    """Run one history sync for the notified mailbox."""
+    from .gmail_auth import authenticate_gmail
+
+    mailbox = watched_mailbox(email_address)
+    if mailbox is None:
+        print(f"Ignoring push for {email_address}: not a connected mailbox")
+        return None
+    account, state = mailbox
+
+    if state.history_id is None:
+        # Nothing to diff against yet; start tracking from this point on
+        state.history_id = history_id
+        state.save()
+        return None
+
+    return sync_history(authenticate_gmail(account), state, account=account)
+
+
+class PushDebouncer:
+    """
+    Coalesces bursts of push notifications per mailbox.
+
+    The first notification arms a timer; anything that arrives before it
+    fires is folded into the same sync. Notifications that arrive while a
+    sync is running re-arm the timer, so there is never more than one sync
+    per mailbox in flight and none are lost.
+    """
+
+    def __init__(self, handler, delay):
+        self.handler = handler
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._timers = {}
+        self._latest = {}
+        self._running = set()
+
+    def notify(self, key, history_id):
+        with self._lock:
+            self._latest[key] = max(history_id, self._latest.get(key, 0))
+            if key not in self._timers:
+                self._arm(key)
+
+    def _arm(self, key):
+        timer = threading.Timer(self.delay, self._fire, args=(key,))
+        timer.daemon = True
+        self._timers[key] = timer
+        timer.start()
+
+    def _fire(self, key):
+        with self._lock:
+            self._timers.pop(key, None)
+            if key in self._running:
+                self._arm(key)
+                return
+            history_id = self._latest.pop(key, None)
+            if history_id is None:
+                return
+            self._running.add(key)
+
+        try:
+            self.handler(key, history_id)
+        except Exception as e:
+            print(f"Push sync failed for {key}: {e}")
+        finally:
+            with self._lock:
+                self._running.discard(key)
+
+    def flush(self):
+        """Runs every pending sync right now (used by tests/shutdown)."""
+        with self._lock:
+            keys = list(self._timers)
+            for key in keys:
+                self._timers[key].cancel()
+        for key in keys:
+            self._fire(key)
+
+
+# Each history page and fetch batch inside a sync is its own job on the
+# fair scheduler, so many mailboxes syncing at once share workers and
+# each is charged for the calls it actually makes.
+push_debouncer = PushDebouncer(sync_mailbox, settings.GMAIL_PUSH_DEBOUNCE_SECONDS)
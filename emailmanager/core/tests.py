@@ -1,3 +1,1058 @@
-from django.test import TestCase
+import base64
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import httplib2
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .archive import MboxArchiveWriter, archive_compression, export_messages, load_index, read_archived_message
+from .models import GmailAccount, MailboxCubeCell, Message, ReviewDecision, SyncState
+from .review import create_session, discard_everywhere
+from .scheduler import FairScheduler
+from . import classifier, clustering, cube, services, transport
+from .services import mass_delete_promotions
+from .sync import PushDebouncer, backfill_index, start_watch, sync_history, sync_mailbox
+
+
+# ------------------------------------------------------------
+# A fake Gmail client: just enough of googleapiclient for core/
+# ------------------------------------------------------------
+class FakeHttpError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.resp = SimpleNamespace(status=status)
+
+
+class FakeRequest:
+    def __init__(self, fn):
+        self.fn = fn
+
+    def execute(self, http=None):
+        return self.fn()
+
+
+class FakeBatch:
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self, http=None):
+        for request_id, request in self.requests:
+            try:
+                response = request.execute()
+            except Exception as e:
+                self.callback(request_id, None, e)
+            else:
+                self.callback(request_id, response, None)
+
+
+class FakeMessages:
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def list(self, userId, q="", pageToken=None, maxResults=100, fields=None):
+        def run():
+            if self.gmail.list_status:
+                raise FakeHttpError(self.gmail.list_status)
+            if any(broken in q for broken in self.gmail.broken_queries):
+                raise FakeHttpError(500)
+            ids = sorted(self.gmail.mailbox)
+            start = int(pageToken or 0)
+            page = ids[start:start + maxResults]
+            response = {"messages": [{"id": msg_id} for msg_id in page], "resultSizeEstimate": len(ids)}
+            if start + maxResults < len(ids):
+                response["nextPageToken"] = str(start + maxResults)
+            return response
+        return FakeRequest(run)
+
+    def get(self, userId, id, format="full", **kwargs):
+        def run():
+            if id in self.gmail.broken or id not in self.gmail.mailbox:
+                raise FakeHttpError(404)
+            msg = dict(self.gmail.mailbox[id])
+            raw = msg.pop("raw_bytes")
+            if format == "raw":
+                return {"id": id, "internalDate": msg["internalDate"],
+                        "raw": base64.urlsafe_b64encode(raw).decode()}
+            return msg
+        return FakeRequest(run)
+
+    def delete(self, userId, id):
+        return FakeRequest(lambda: self.gmail.delete([id]))
+
+    def batchDelete(self, userId, body):
+        return FakeRequest(lambda: self.gmail.delete(body["ids"]))
+
+
+class FakeHistory:
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def list(self, userId, startHistoryId, historyTypes=None, pageToken=None, maxResults=100):
+        def run():
+            if self.gmail.history_expired:
+                raise FakeHttpError(404)
+            return {"history": self.gmail.history_records, "historyId": str(self.gmail.history_id)}
+        return FakeRequest(run)
+
+
+class FakeGmail:
+    """In-memory mailbox that records every delete."""
+
+    def __init__(self, messages=(), email_address="me@example.com"):
+        self.mailbox = {m["id"]: m for m in messages}
+        self.email_address = email_address
+        self.scheduler_key = email_address
+        self._http = SimpleNamespace(thread_safe=True)
+        self.broken = set()  # IDs whose get() fails
+        self.deleted = []
+        self.history_records = []
+        self.history_id = 100
+        self.history_expired = False
+        self.list_status = None  # HTTP status list() fails with
+        self.broken_queries = set()  # list() fails when q contains one of these
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return FakeMessages(self)
+
+    def history(self):
+        return FakeHistory(self)
+
+    def getProfile(self, userId):
+        return FakeRequest(lambda: {"emailAddress": self.email_address, "historyId": str(self.history_id)})
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(callback)
+
+    def delete(self, ids):
+        self.deleted.extend(ids)
+        for msg_id in ids:
+            self.mailbox.pop(msg_id, None)
+        return ""
+
+
+def fake_message(msg_id, sender="shop@example.com", subject="Hello", snippet="", labels=("UNREAD",),
+                 size=1000, thread_id=None, internal_ms=1600000000000, body=b"Hi there\r\n"):
+    return {
+        "id": msg_id,
+        "threadId": thread_id or f"t-{msg_id}",
+        "labelIds": list(labels),
+        "snippet": snippet,
+        "sizeEstimate": size,
+        "internalDate": str(internal_ms),
+        "payload": {"headers": [{"name": "From", "value": sender}, {"name": "Subject", "value": subject}]},
+        "raw_bytes": f"From: {sender}\r\nSubject: {subject}\r\n\r\n".encode() + body,
+    }
+
+
+# ------------------------------------------------------------
+# Archive before delete
+# ------------------------------------------------------------
+class ArchiveTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "purge.mbox.gz")
+
+    def test_round_trip_across_blocks(self):
+        bodies = {f"m{i}": f"Message number {i}\r\n".encode() * 50 for i in range(20)}
+        bodies["m5"] = b"From the desk of the CEO\r\n>From quoted\r\n"
+
+        # A tiny block size forces many gzip members
+        with MboxArchiveWriter(self.path, block_size=2048) as writer:
+            for msg_id, body in bodies.items():
+                writer.add(msg_id, body, 1600000000000)
+
+        index = load_index(self.path)
+        self.assertEqual(set(index), set(bodies))
+        self.assertGreater(len({entry[0] for entry in index.values()}), 1)
+
+        entry = read_archived_message(self.path, "m3", index=index)
+        self.assertTrue(entry.startswith(b"From MAILER-DAEMON "))
+        self.assertIn(b"Message number 3\n", entry)
+        self.assertNotIn(b"\r\n", entry)
+
+        # Body lines starting with "From " are escaped mboxrd-style
+        escaped = read_archived_message(self.path, "m5", index=index)
+        self.assertIn(b"\n>From the desk of the CEO\n>>From quoted\n", escaped)
+
+        # The whole file is still one valid multi-member gzip stream
+        with gzip.open(self.path, "rb") as f:
+            self.assertEqual(f.read().count(b"From MAILER-DAEMON "), len(bodies))
+
+    def test_appends_to_an_existing_archive(self):
+        with MboxArchiveWriter(self.path) as writer:
+            writer.add("a", b"first\r\n")
+        with MboxArchiveWriter(self.path) as writer:
+            writer.add("b", b"second\r\n")
+
+        index = load_index(self.path)
+        self.assertIn(b"first", read_archived_message(self.path, "a", index=index))
+        self.assertIn(b"second", read_archived_message(self.path, "b", index=index))
+
+    def test_flush_syncs_the_block_and_its_index(self):
+        with MboxArchiveWriter(self.path) as writer:
+            writer.add("a", b"first\r\n")
+            with mock.patch("core.archive.os.fsync") as fsync:
+                writer.flush()
+            synced = [call.args[0] for call in fsync.call_args_list]
+            self.assertEqual(synced, [writer._file.fileno(), writer._index.fileno()])
+
+    def test_appending_with_another_compression_is_rejected(self):
+        with MboxArchiveWriter(self.path) as writer:
+            writer.add("a", b"first\r\n")
+        self.assertEqual(archive_compression(self.path), "gzip")
+
+        with self.assertRaisesRegex(ValueError, "gzip archive"):
+            MboxArchiveWriter(self.path, compression="zstd")
+
+        other = self.path + ".zst"
+        with open(other + ".idx", "w") as f:
+            f.write("# compression=zstd\n")
+        with self.assertRaisesRegex(ValueError, "zstd archive"):
+            MboxArchiveWriter(other)
+
+    def test_compression_of_archives_without_the_header_is_sniffed(self):
+        with MboxArchiveWriter(self.path) as writer:
+            writer.add("a", b"first\r\n")
+        with open(self.path + ".idx") as f:
+            lines = [line for line in f if not line.startswith("# compression=")]
+        with open(self.path + ".idx", "w") as f:
+            f.writelines(lines)
+
+        self.assertEqual(archive_compression(self.path), "gzip")
+        self.assertIn(b"first", read_archived_message(self.path, "a"))
+
+    def test_export_skips_messages_that_fail_to_download(self):
+        gmail = FakeGmail([fake_message(f"m{i}") for i in range(7)])
+        gmail.broken = {"m2", "m6"}
+
+        with MboxArchiveWriter(self.path) as writer:
+            archived = export_messages(gmail, sorted(gmail.mailbox), writer)
+
+        self.assertEqual(archived, ["m0", "m1", "m3", "m4", "m5"])
+        self.assertEqual(set(load_index(self.path)), set(archived))
+
+    def test_mass_delete_only_deletes_what_was_archived(self):
+        gmail = FakeGmail([fake_message(f"m{i}") for i in range(12)])
+        gmail.broken = {"m4", "m9"}
+
+        deleted = mass_delete_promotions(gmail, 2020, archive_path=self.path)
+
+        self.assertEqual(deleted, 10)
+        self.assertNotIn("m4", gmail.deleted)
+        self.assertNotIn("m9", gmail.deleted)
+        self.assertEqual(set(gmail.deleted), set(load_index(self.path)))
+        for msg_id in gmail.deleted:
+            self.assertIn(b"Hi there", read_archived_message(self.path, msg_id))
+
+
+# ------------------------------------------------------------
+# Push notifications + history sync
+# ------------------------------------------------------------
+class PushDebouncerTests(TestCase):
+    def test_burst_coalesces_into_one_sync_with_the_latest_history_id(self):
+        calls = []
+        done = threading.Event()
+
+        def handler(key, history_id):
+            calls.append((key, history_id))
+            done.set()
+
+        debouncer = PushDebouncer(handler, delay=0.1)
+        for history_id in (5, 9, 7, 8):
+            debouncer.notify("me@example.com", history_id)
+
+        self.assertTrue(done.wait(2))
+        self.assertEqual(calls, [("me@example.com", 9)])
+
+    def test_mailboxes_are_debounced_independently(self):
+        calls = []
+        debouncer = PushDebouncer(lambda key, history_id: calls.append((key, history_id)), delay=60)
+        debouncer.notify("a@example.com", 1)
+        debouncer.notify("b@example.com", 2)
+        debouncer.notify("a@example.com", 3)
+
+        debouncer.flush()
+        self.assertEqual(sorted(calls), [("a@example.com", 3), ("b@example.com", 2)])
+
+    def test_notification_during_a_sync_runs_once_more_afterwards(self):
+        calls = []
+        started, release, second = threading.Event(), threading.Event(), threading.Event()
+
+        def handler(key, history_id):
+            calls.append(history_id)
+            if len(calls) == 1:
+                started.set()
+                release.wait(2)
+            else:
+                second.set()
+
+        debouncer = PushDebouncer(handler, delay=0.05)
+        debouncer.notify("me@example.com", 1)
+        self.assertTrue(started.wait(2))
+        debouncer.notify("me@example.com", 2)
+        release.set()
+
+        self.assertTrue(second.wait(2))
+        self.assertEqual(calls, [1, 2])
+
+
+class SyncHistoryTests(TestCase):
+    def setUp(self):
+        self.gmail = FakeGmail([fake_message("new", subject="Fresh")])
+        self.state = SyncState.objects.create(email_address="me@example.com", history_id=50)
+        Message.objects.create(gmail_id="old", sender="a@example.com", label_ids=["INBOX"])
+        Message.objects.create(gmail_id="read-me", sender="b@example.com", label_ids=["UNREAD"], is_unread=True)
+
+    def test_applies_added_deleted_and_relabelled_messages(self):
+        self.gmail.history_id = 60
+        self.gmail.history_records = [
+            {"messagesAdded": [{"message": {"id": "new"}}]},
+            {"messagesDeleted": [{"message": {"id": "old"}}]},
+            {"labelsRemoved": [{"message": {"id": "read-me", "labelIds": ["INBOX"]}}]},
+        ]
+
+        result = sync_history(self.gmail, self.state)
+
+        self.assertEqual(result, {"added": 1, "deleted": 1, "relabelled": 1})
+        self.assertEqual(Message.objects.get(gmail_id="new").subject, "Fresh")
+        self.assertFalse(Message.objects.filter(gmail_id="old").exists())
+        self.assertFalse(Message.objects.get(gmail_id="read-me").is_unread)
+        self.state.refresh_from_db()
+        self.assertEqual(self.state.history_id, 60)
+
+    def test_added_then_deleted_in_the_same_window_is_not_indexed(self):
+        self.gmail.history_records = [
+            {"messagesAdded": [{"message": {"id": "new"}}]},
+            {"messagesDeleted": [{"message": {"id": "new"}}]},
+        ]
+        sync_history(self.gmail, self.state)
+        self.assertFalse(Message.objects.filter(gmail_id="new").exists())
+
+    def test_expired_history_id_triggers_a_full_resync(self):
+        self.gmail.history_expired = True
+        self.gmail.history_id = 75
+
+        result = sync_history(self.gmail, self.state)
+
+        self.assertTrue(result["resynced"])
+        # The backfill indexes what Gmail has and drops what it doesn't
+        self.assertEqual(list(Message.objects.values_list("gmail_id", flat=True)), ["new"])
+        self.state.refresh_from_db()
+        self.assertEqual(self.state.history_id, 75)
+
+    def test_other_history_errors_propagate(self):
+        with mock.patch.object(FakeHistory, "list", side_effect=FakeHttpError(500)):
+            with self.assertRaises(FakeHttpError):
+                sync_history(self.gmail, self.state)
+        self.state.refresh_from_db()
+        self.assertEqual(self.state.history_id, 50)
+
+    def test_backfill_keeps_rows_it_could_not_refresh(self):
+        self.gmail.mailbox["old"] = fake_message("old")
+        self.gmail.broken = {"old"}
+        backfill_index(self.gmail)
+        self.assertTrue(Message.objects.filter(gmail_id="old").exists())
+
+
+class FakeNotifier:
+    """Stands in for core.sync.push_debouncer."""
+
+    def __init__(self):
+        self.notifications = []
+
+    def notify(self, key, history_id):
+        self.notifications.append((key, history_id))
+
+
+@override_settings(GMAIL_PUSH_TOKEN="s3cret")
+class GmailPushTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.notifier = FakeNotifier()
+        patcher = mock.patch("core.sync.push_debouncer", self.notifier)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        GmailAccount.objects.create(email_address="me@example.com", token="{}")
+
+    def push(self, email_address, history_id=42, token="s3cret"):
+        data = base64.b64encode(json.dumps({"emailAddress": email_address, "historyId": history_id}).encode())
+        url = "/api/gmail/push/" + (f"?token={token}" if token else "")
+        return self.client.post(url, {"message": {"data": data.decode()}}, format="json")
+
+    def test_connected_mailbox_is_handed_to_the_debouncer(self):
+        response = self.push("me@example.com")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.notifier.notifications, [("me@example.com", 42)])
+
+    def test_wrong_or_missing_token_is_rejected(self):
+        self.assertEqual(self.push("me@example.com", token="nope").status_code, 403)
+        self.assertEqual(self.push("me@example.com", token=None).status_code, 403)
+        self.assertEqual(self.notifier.notifications, [])
+
+    @override_settings(GMAIL_PUSH_TOKEN="")
+    def test_rejected_when_no_token_is_configured(self):
+        self.assertEqual(self.push("me@example.com", token="").status_code, 403)
+        self.assertEqual(self.notifier.notifications, [])
+
+    def test_unknown_mailbox_is_acked_and_ignored(self):
+        response = self.push("stranger@example.com")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.notifier.notifications, [])
+        self.assertFalse(SyncState.objects.filter(email_address="stranger@example.com").exists())
+
+    def test_malformed_notification(self):
+        response = self.client.post("/api/gmail/push/?token=s3cret", {"message": {}}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_deactivated_account_is_ignored_while_its_watch_lingers(self):
+        GmailAccount.objects.create(email_address="gone@example.com", token="{}", is_active=False)
+        SyncState.objects.create(email_address="gone@example.com", history_id=10)
+
+        self.assertEqual(self.push("gone@example.com").status_code, 204)
+        self.assertEqual(self.notifier.notifications, [])
+        with mock.patch("core.gmail_auth.authenticate_gmail") as authenticate:
+            self.assertIsNone(sync_mailbox("gone@example.com", 42))
+        authenticate.assert_not_called()
+
+    def test_only_the_marked_legacy_mailbox_uses_token_json(self):
+        SyncState.objects.create(email_address="legacy@example.com", history_id=10, legacy=True)
+        SyncState.objects.create(email_address="leftover@example.com", history_id=10)
+
+        self.push("legacy@example.com")
+        self.push("leftover@example.com")
+        self.assertEqual(self.notifier.notifications, [("legacy@example.com", 42)])
+
+    def test_watch_records_which_mailbox_is_legacy(self):
+        account = GmailAccount.objects.get(email_address="me@example.com")
+        gmail = FakeGmail()
+        gmail.watch = lambda userId, body: FakeRequest(lambda: {"historyId": "5", "expiration": "1900000000000"})
+
+        with override_settings(GMAIL_PUSH_TOPIC="projects/p/topics/t"):
+            self.assertFalse(start_watch(gmail, account=account).legacy)
+            self.assertTrue(start_watch(gmail).legacy)
+
+
+# ------------------------------------------------------------
+# Near-duplicate / template clustering
+# ------------------------------------------------------------
+class ClusteringTests(TestCase):
+    def add(self, gmail_id, subject, snippet="", sender="news@shop.com", account=None):
+        return Message.objects.create(
+            gmail_id=gmail_id, sender=sender, subject=subject, snippet=snippet, account=account
+        )
+
+    def keys(self):
+        return dict(Message.objects.values_list("gmail_id", "cluster_key"))
+
+    def test_template_mail_clusters_despite_numbers_and_urls(self):
+        for i, (order, url) in enumerate([(1042, "a1"), (77310, "zz9"), (5, "q")]):
+            self.add(f"order{i}", f"Your order #{order} has shipped",
+                     f"Track it at https://shop.com/t/{url} - thanks for shopping with us")
+        self.add("bank", "Statement available", "Your monthly statement is ready", sender="bank@bank.com")
+
+        self.assertEqual(clustering.cluster_messages(), 1)
+        keys = self.keys()
+        self.assertNotEqual(keys["order0"], "")
+        self.assertEqual(keys["order0"], keys["order1"])
+        self.assertEqual(keys["order0"], keys["order2"])
+        self.assertEqual(keys["bank"], "")
+
+    def test_lsh_joins_fingerprints_within_max_distance_only(self):
+        base = 0x0123456789ABCDEF
+        fingerprints = {
+            "same": base,
+            "near": base ^ 0b101,  # 2 bits away: same cluster
+            "far": base ^ (0xF << 60),  # 4 bits away: more than MAX_DISTANCE
+            "other": 0xFEDCBA9876543210,
+        }
+        for subject in fingerprints:
+            self.add(f"{subject}-1", subject)
+        self.add("same-2", "same")
+
+        with mock.patch.object(clustering, "simhash", lambda sender, subject, snippet: fingerprints[subject]):
+            self.assertEqual(clustering.cluster_messages(), 1)
+
+        keys = self.keys()
+        self.assertEqual(keys["same-1"], keys["same-2"])
+        self.assertEqual(keys["same-1"], keys["near-1"])
+        self.assertEqual(keys["far-1"], "")
+        self.assertEqual(keys["other-1"], "")
+
+    def test_reclustering_clears_stale_keys(self):
+        self.add("a", "Weekly digest", "top stories")
+        self.add("b", "Weekly digest", "top stories")
+        clustering.cluster_messages()
+        Message.objects.filter(gmail_id="b").delete()
+
+        self.assertEqual(clustering.cluster_messages(), 0)
+        self.assertEqual(self.keys(), {"a": ""})
+
+    def test_simhash_takes_the_per_bit_majority(self):
+        hashes = {"from:shop.com": 0b0111, "a": 0b0011, "b": 0b0001, "a b": 0b1000}
+        digest = lambda feature, digest_size: SimpleNamespace(digest=lambda: hashes[feature.decode()].to_bytes(8, "big"))
+        with mock.patch.object(clustering.hashlib, "blake2b", digest):
+            # Bit 0 is set by 3 of 4 features, bit 1 by exactly half
+            self.assertEqual(clustering._simhash.__wrapped__("shop.com", ("a", "b")), 0b0001)
+
+    def test_listing_never_reclusters(self):
+        self.add("a", "Weekly digest", "top stories")
+        with mock.patch.object(clustering, "cluster_messages") as recluster:
+            response = APIClient().get("/api/clusters/", {"refresh": "1"})
+        self.assertEqual(response.status_code, 200)
+        recluster.assert_not_called()
+
+    def test_clusters_and_deletes_stay_within_one_account(self):
+        account = GmailAccount.objects.create(email_address="other@example.com", token="{}")
+        for i in range(3):
+            self.add(f"mine{i}", "Flash sale", "50% off today")
+            self.add(f"theirs{i}", "Flash sale", "50% off today", account=account)
+
+        clustering.cluster_messages()
+        [cluster] = clustering.list_clusters(min_size=2)
+        self.assertEqual(cluster["count"], 3)
+        self.assertEqual(clustering.list_clusters(account), [])
+
+        gmail = FakeGmail()
+        self.assertEqual(clustering.delete_cluster(gmail, cluster["key"]), 3)
+        self.assertEqual(sorted(gmail.deleted), ["mine0", "mine1", "mine2"])
+        self.assertEqual(Message.objects.filter(account=account).count(), 3)
+
+
+# ------------------------------------------------------------
+# Multiple accounts: fair scheduler and isolation
+# ------------------------------------------------------------
+class FairSchedulerTests(TestCase):
+    def make_scheduler(self, workers=1):
+        scheduler = FairScheduler(workers=workers)
+        self.addCleanup(scheduler.shutdown)
+        return scheduler
+
+    def test_accounts_take_turns(self):
+        scheduler = self.make_scheduler()
+        gate = threading.Event()
+        order = []
+
+        # Hold the only worker while both queues fill up
+        scheduler.submit("gate", gate.wait, 2, cost=1)
+        futures = [scheduler.submit("big", order.append, f"big{i}", cost=1) for i in range(4)]
+        futures += [scheduler.submit("small", order.append, f"small{i}", cost=1) for i in range(2)]
+        gate.set()
+        for future in futures:
+            future.result(timeout=2)
+
+        self.assertEqual(order, ["big0", "small0", "big1", "small1", "big2", "big3"])
+
+    def test_quota_delays_jobs_instead_of_exceeding_it(self):
+        scheduler = self.make_scheduler(workers=4)
+        scheduler.configure_account("a@example.com", units_per_second=100)
+
+        start = time.monotonic()
+        futures = [scheduler.submit("a@example.com", time.monotonic, cost=50) for _ in range(3)]
+        finished = sorted(future.result(timeout=5) - start for future in futures)
+
+        # One second of burst pays for two jobs; the third waits for a refill
+        self.assertLess(finished[1], 0.2)
+        self.assertGreaterEqual(finished[2], 0.4)
+
+    def test_concurrency_cap_per_account(self):
+        scheduler = self.make_scheduler(workers=4)
+        scheduler.configure_account("a@example.com", max_concurrency=1)
+        lock = threading.Lock()
+        running, peak = [0], [0]
+
+        def job():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+
+        for future in [scheduler.submit("a@example.com", job, cost=1) for _ in range(4)]:
+            future.result(timeout=2)
+        self.assertEqual(peak[0], 1)
+
+    def test_job_submitting_a_job_does_not_deadlock(self):
+        scheduler = self.make_scheduler(workers=1)
+        outer = scheduler.submit("a", lambda: scheduler.submit("a", lambda: 42, cost=1).result(timeout=2), cost=1)
+        self.assertEqual(outer.result(timeout=2), 42)
+
+    def test_errors_come_back_through_the_future(self):
+        scheduler = self.make_scheduler()
+        future = scheduler.submit("a", int, "not a number", cost=1)
+        with self.assertRaises(ValueError):
+            future.result(timeout=2)
+
+
+class ThreadHttpTests(TestCase):
+    def client_for(self, key):
+        from google.oauth2.credentials import Credentials
+
+        # A fresh Credentials object per client, like authenticate_gmail()
+        http = SimpleNamespace(credentials=Credentials(token="t"))
+        return SimpleNamespace(_http=http, scheduler_key=key)
+
+    def run_in_thread(self, fn):
+        result = []
+        thread = threading.Thread(target=lambda: result.append(fn()))
+        thread.start()
+        thread.join()
+        return result[0]
+
+    def test_one_connection_per_account_per_thread(self):
+        def calls():
+            for _ in range(50):
+                services.thread_http(self.client_for("a@example.com"))
+                services.thread_http(self.client_for("b@example.com"))
+            return services._thread_local.http_by_account
+
+        cache = self.run_in_thread(calls)
+        self.assertEqual(sorted(cache), ["a@example.com", "b@example.com"])
+
+    def test_same_credentials_reuse_the_connection(self):
+        def calls():
+            client = self.client_for("a@example.com")
+            return services.thread_http(client), services.thread_http(client)
+
+        first, second = self.run_in_thread(calls)
+        self.assertIs(first, second)
+
+
+class PooledHttpTests(TestCase):
+    def setUp(self):
+        from google.oauth2.credentials import Credentials
+
+        self.credentials = Credentials(token="fresh")
+        patcher = mock.patch.dict(transport._pools, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def response(self, status, headers, content):
+        import io
+
+        import requests
+        import urllib3
+
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers)
+        response.raw = urllib3.HTTPResponse(
+            body=io.BytesIO(content), headers=headers, status=status, preload_content=False
+        )
+        return response
+
+    def test_request_looks_like_httplib2(self):
+        http = transport.PooledHttp(self.credentials, timeout=5)
+        body = json.dumps({"id": "m1"}).encode()
+        compressed = gzip.compress(body)
+        gzipped = self.response(200, {"Content-Type": "application/json", "Content-Encoding": "gzip",
+                                      "Content-Length": str(len(compressed))}, compressed)
+
+        with mock.patch.object(http.session, "request", return_value=gzipped) as request:
+            response, content = http.request("https://gmail.googleapis.com/x", "POST", body="{}",
+                                             headers={"a": "b"}, redirections=0)
+
+        request.assert_called_once_with("POST", "https://gmail.googleapis.com/x", data="{}", headers={"a": "b"},
+                                        timeout=5, allow_redirects=False)
+        self.assertIsInstance(response, httplib2.Response)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response["content-type"], "application/json")
+        for header in ("content-encoding", "content-length", "transfer-encoding"):
+            self.assertNotIn(header, response)
+        self.assertEqual(content, body)
+
+    def test_error_status_and_redirects(self):
+        http = transport.PooledHttp(self.credentials)
+        with mock.patch.object(http.session, "request", return_value=self.response(404, {}, b"")) as request:
+            response, _ = http.request("https://gmail.googleapis.com/x")
+        self.assertEqual(response.status, 404)
+        self.assertTrue(request.call_args.kwargs["allow_redirects"])
+
+    def test_pool_is_reused_and_gets_fresh_credentials(self):
+        from google.oauth2.credentials import Credentials
+
+        http = transport.pooled_http("token.json", self.credentials)
+        self.assertIs(transport.pooled_http("token.json", Credentials(token="other")), http)
+        # Still valid, so it is kept
+        self.assertIs(http.credentials, self.credentials)
+
+        self.credentials.token = None  # expired and not yet refreshed
+        refreshed = Credentials(token="refreshed")
+        self.assertIs(transport.pooled_http("token.json", refreshed), http)
+        self.assertIs(http.credentials, refreshed)
+
+        self.assertIsNot(transport.pooled_http("work.json", refreshed), http)
+
+
+class AccountIsolationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.account = GmailAccount.objects.create(email_address="work@example.com", token="{}")
+        when = timezone.now()
+        Message.objects.create(gmail_id="same-id", subject="personal", size_estimate=10, internal_date=when)
+        Message.objects.create(
+            gmail_id="same-id", subject="work", size_estimate=20, internal_date=when, account=self.account
+        )
+
+    def test_gmail_ids_are_unique_per_account_only(self):
+        self.assertEqual(Message.objects.filter(gmail_id="same-id").count(), 2)
+
+    def test_unknown_account_is_a_404(self):
+        for url in ("/api/list-recent-unread/", "/api/largest-messages/", "/api/mailbox-cube/"):
+            response = self.client.get(url, {"account": "nobody@example.com"})
+            self.assertEqual(response.status_code, 404, url)
+            self.assertIn("No connected Gmail account", response.json()["detail"], url)
+
+    def test_index_backed_views_honor_the_account(self):
+        mine = self.client.get("/api/largest-messages/").json()
+        work = self.client.get("/api/largest-messages/", {"account": "work@example.com"}).json()
+        self.assertEqual([m["subject"] for m in mine["messages"]], ["personal"])
+        self.assertEqual([m["subject"] for m in work["messages"]], ["work"])
+
+        self.client.post("/api/mailbox-cube/refresh/?account=work@example.com", {"source": "index"}, format="json")
+        self.assertEqual(MailboxCubeCell.objects.filter(account=None).count(), 0)
+        self.assertEqual(MailboxCubeCell.objects.filter(account=self.account).count(), 1)
+
+
+# ------------------------------------------------------------
+# Review sessions
+# ------------------------------------------------------------
+class ReviewSessionTests(TestCase):
+    def setUp(self):
+        self.gmail = FakeGmail([fake_message(f"m{i}", subject=f"Subject {i}") for i in range(8)])
+        for target in ("core.gmail_auth.authenticate_gmail", "core.views.authenticate_gmail"):
+            patcher = mock.patch(target, return_value=self.gmail)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def ids(self, page):
+        return [email["id"] for email in page]
+
+    def test_pages_come_from_the_prefetched_buffer(self):
+        session = create_session(page_size=3)
+        self.assertEqual(self.ids(session.next_page()), ["m0", "m1", "m2"])
+        self.assertEqual(self.ids(session.next_page()), ["m3", "m4", "m5"])
+        self.assertEqual(self.ids(session.next_page()), ["m6", "m7"])
+        self.assertTrue(session.exhausted)
+
+    def test_discarded_messages_are_never_shown(self):
+        session = create_session(page_size=2)
+        self.assertEqual(self.ids(session.next_page()), ["m0", "m1"])
+
+        # Kept/deleted from another tab, or before the prefetcher got to them
+        discard_everywhere(["m2", "m5"])
+        self.assertEqual(self.ids(session.next_page()), ["m3", "m4"])
+        self.assertEqual(self.ids(session.next_page()), ["m6", "m7"])
+
+    def test_deletes_seen_by_history_sync_are_discarded(self):
+        session = create_session(page_size=2)
+        session.next_page()
+
+        state = SyncState.objects.create(email_address="me@example.com", history_id=1)
+        self.gmail.history_records = [{"messagesDeleted": [{"message": {"id": "m3"}}]}]
+        sync_history(self.gmail, state)
+
+        self.assertEqual(self.ids(session.next_page()), ["m2", "m4"])
+
+    def test_prefetch_errors_reach_the_ui_and_can_be_retried(self):
+        self.gmail.list_status = 503
+        client = APIClient()
+        response = client.post("/api/review-session/", {"page_size": 3}, format="json")
+        self.assertEqual(response.status_code, 502)
+        self.assertIn("HTTP 503", response.json()["error"])
+
+        self.gmail.list_status = None
+        response = client.get(f"/api/review-session/{response.json()['session_id']}/next/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.ids(response.json()["emails"]), ["m0", "m1", "m2"])
+
+    def test_page_size_is_validated(self):
+        client = APIClient()
+        for page_size in (0, -5, "lots"):
+            response = client.post("/api/review-session/", {"page_size": page_size}, format="json")
+            self.assertEqual(response.status_code, 400, page_size)
+
+    def test_bulk_delete_from_the_review_ui_records_decisions(self):
+        client = APIClient()
+        response = client.post("/api/batch-delete/", {"ids": ["m0", "m1"], "record": True}, format="json")
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(sorted(self.gmail.deleted), ["m0", "m1"])
+        decisions = ReviewDecision.objects.order_by("gmail_id")
+        self.assertEqual([(d.gmail_id, d.decision) for d in decisions],
+                         [("m0", ReviewDecision.DELETE), ("m1", ReviewDecision.DELETE)])
+        # Features were read before Gmail deleted the messages
+        self.assertEqual(decisions[0].subject, "Subject 0")
+
+    def test_plain_batch_delete_records_nothing(self):
+        client = APIClient()
+        client.post("/api/batch-delete/", {"ids": ["m0"]}, format="json")
+        self.assertEqual(self.gmail.deleted, ["m0"])
+        self.assertFalse(ReviewDecision.objects.exists())
+
+
+# ------------------------------------------------------------
+# Mailbox composition cube
+# ------------------------------------------------------------
+class MailboxCubeTests(TestCase):
+    def setUp(self):
+        self.gmail = FakeGmail()
+        self.client = APIClient()
+
+        # A private scheduler with quota to spare, so 120 probes take no time
+        scheduler = FairScheduler(workers=4)
+        scheduler.configure_account(self.gmail.scheduler_key, units_per_second=100000, max_concurrency=4)
+        self.addCleanup(scheduler.shutdown)
+        patcher = mock.patch.object(services, "get_scheduler", return_value=scheduler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cell(self, year, month=1, category="social", is_unread=True, count=7,
+             source=MailboxCubeCell.SOURCE_ESTIMATE, **kwargs):
+        return MailboxCubeCell.objects.create(
+            year=year, month=month, category=category, is_unread=is_unread, count=count, source=source, **kwargs
+        )
+
+    def build(self, probe, from_year, to_year):
+        with mock.patch.object(cube, "_probe", probe):
+            return cube.build_cube_from_estimates(self.gmail, from_year, to_year)
+
+    def test_estimate_rebuild_only_replaces_the_probed_years(self):
+        self.cell(2012, source=MailboxCubeCell.SOURCE_INDEX, bytes=100)
+        self.cell(2015, count=1)
+
+        self.build(lambda service, year, month, category, is_unread: 3, 2015, 2015)
+
+        self.assertEqual(MailboxCubeCell.objects.get(year=2012).count, 7)
+        cells = MailboxCubeCell.objects.filter(year=2015)
+        self.assertEqual(cells.count(), 12 * len(cube.CATEGORIES) * 2)
+        self.assertEqual({c.count for c in cells}, {3})
+
+    def test_failed_probe_keeps_the_previous_count_as_stale(self):
+        self.gmail.mailbox = {f"m{i}": fake_message(f"m{i}") for i in range(4)}
+        self.cell(2015, month=3, category="social", is_unread=True, count=7, bytes=900)
+        self.cell(2015, month=4, category="social", is_unread=True, count=5)
+        self.gmail.broken_queries = {"category:social is:unread after:2015/03/01"}
+
+        cube.build_cube_from_estimates(self.gmail, 2015, 2015)
+
+        stale = MailboxCubeCell.objects.get(stale=True)
+        self.assertEqual((stale.month, stale.count, stale.bytes), (3, 7, 900))
+        # Every other cell holds the fresh estimate
+        fresh = MailboxCubeCell.objects.filter(stale=False)
+        self.assertEqual(fresh.count(), 12 * len(cube.CATEGORIES) * 2 - 1)
+        self.assertEqual({c.count for c in fresh}, {4})
+
+        result = cube.get_cube()
+        self.assertEqual(result["stale_cells"], 1)
+        self.assertFalse(result["complete"])
+        self.assertTrue(result["years"][0]["stale"])
+
+    def test_failed_probe_without_a_previous_cell_is_a_stale_zero(self):
+        self.gmail.mailbox = {"m0": fake_message("m0")}
+        self.gmail.broken_queries = {"category:forums is:read after:2015/12/01"}
+
+        cube.build_cube_from_estimates(self.gmail, 2015, 2015)
+
+        stale = MailboxCubeCell.objects.get(stale=True)
+        self.assertEqual((stale.month, stale.category, stale.is_unread, stale.count), (12, "forums", False, 0))
+
+    def test_every_probe_failing_leaves_the_cube_unchanged(self):
+        self.cell(2015, count=7)
+        self.gmail.list_status = 503
+
+        self.assertEqual(cube.build_cube_from_estimates(self.gmail, 2015, 2015), 0)
+
+        [cell] = MailboxCubeCell.objects.all()
+        self.assertEqual((cell.count, cell.stale), (7, False))
+        self.assertTrue(cube.get_cube()["complete"])
+
+    def test_get_is_read_only(self):
+        self.cell(2015)
+        with mock.patch.object(cube, "build_cube_from_index") as rebuild:
+            response = self.client.get("/api/mailbox-cube/", {"refresh": "index"})
+        rebuild.assert_not_called()
+        self.assertEqual(response.json()["cells"][0]["count"], 7)
+
+    def test_estimate_refresh_runs_in_the_background(self):
+        with mock.patch("core.views.authenticate_gmail", return_value=self.gmail), \
+                mock.patch("core.views.start_estimate_rebuild", return_value=True) as start:
+            response = self.client.post(
+                "/api/mailbox-cube/refresh/", {"source": "estimate", "from_year": 2015, "to_year": 2016},
+                format="json"
+            )
+        self.assertEqual(response.status_code, 202)
+        start.assert_called_once_with(self.gmail, 2015, 2016, account=None)
+
+    def test_refresh_validates_the_year_range(self):
+        for body in ({"source": "estimate", "from_year": 2003}, {"source": "estimate", "from_year": 2015, "to_year": 2012},
+                     {"source": "everything"}):
+            response = self.client.post("/api/mailbox-cube/refresh/", body, format="json")
+            self.assertEqual(response.status_code, 400, body)
+
+    def test_only_one_background_rebuild_per_account(self):
+        release = threading.Event()
+        with mock.patch.object(cube, "build_cube_from_estimates", lambda *args, **kwargs: release.wait(2)):
+            self.assertTrue(cube.start_estimate_rebuild(self.gmail, 2015))
+            self.assertFalse(cube.start_estimate_rebuild(self.gmail, 2015))
+            release.set()
+
+
+# ------------------------------------------------------------
+# Keep/delete classifier
+# ------------------------------------------------------------
+class ClassifierTests(TestCase):
+    PROMO = ("deals@shop.com", "Huge sale this weekend", "Everything must go")
+    WORK = ("boss@work.com", "Meeting notes", "Agenda for the planning meeting")
+
+    def add(self, gmail_id, fields, score=None):
+        sender, subject, snippet = fields
+        return Message.objects.create(
+            gmail_id=gmail_id, sender=sender, subject=subject, snippet=snippet, delete_score=score
+        )
+
+    def trained_model(self, examples):
+        model = classifier.OnlineClassifier.load()
+        model.state.examples = examples
+        model.save()
+        return model
+
+    def test_partial_fit_learns_a_separable_signal(self):
+        model = classifier.OnlineClassifier.load()
+        promo, work = classifier.extract_features(*self.PROMO), classifier.extract_features(*self.WORK)
+        self.assertAlmostEqual(model.predict_proba(promo), 0.5)
+
+        for _ in range(30):
+            model.partial_fit(promo, 1)
+            model.partial_fit(work, 0)
+        model.save()
+
+        model = classifier.OnlineClassifier.load()
+        self.assertEqual(model.examples, 60)
+        self.assertGreater(model.predict_proba(classifier.extract_features(
+            "deals@shop.com", "Huge sale on shoes", "Last chance")), 0.75)
+        self.assertLess(model.predict_proba(classifier.extract_features(
+            "boss@work.com", "Meeting moved", "See the agenda")), 0.25)
+
+    def test_nothing_is_proposed_before_min_examples(self):
+        self.add("promo", self.PROMO, score=0.99)
+
+        self.trained_model(classifier.MIN_EXAMPLES - 1)
+        result = classifier.propose_deletions()
+        self.assertFalse(result["ready"])
+        self.assertEqual(result["ids"], [])
+
+        self.trained_model(classifier.MIN_EXAMPLES)
+        result = classifier.propose_deletions()
+        self.assertTrue(result["ready"])
+        self.assertEqual(result["ids"], ["promo"])
+
+    def test_kept_and_low_scoring_messages_are_not_proposed(self):
+        self.trained_model(classifier.MIN_EXAMPLES)
+        self.add("promo", self.PROMO, score=0.99)
+        self.add("kept", self.PROMO, score=0.98)
+        self.add("work", self.WORK, score=0.2)
+        ReviewDecision.objects.create(gmail_id="kept", decision=ReviewDecision.KEEP)
+
+        self.assertEqual(classifier.propose_deletions()["ids"], ["promo"])
+
+    def test_rescore_backlog_scores_everything_in_batches(self):
+        self.trained_model(classifier.MIN_EXAMPLES)
+        for i in range(5):
+            self.add(f"m{i}", self.PROMO)
+
+        batches = []
+        score_messages = classifier.score_messages
+        with mock.patch.object(classifier, "score_messages",
+                               lambda batch, model: batches.append(len(batch)) or score_messages(batch, model)):
+            self.assertEqual(classifier.rescore_backlog(batch_size=2), 5)
+
+        self.assertEqual(batches, [2, 2, 1])
+        self.assertFalse(Message.objects.filter(delete_score=None).exists())
+
+    def test_decisions_trigger_a_rescore_every_rescore_every(self):
+        messages = [Message(gmail_id=f"m{i}", sender=self.PROMO[0], subject=self.PROMO[1])
+                    for i in range(classifier.MIN_EXAMPLES)]
+        with mock.patch.object(classifier, "start_rescore") as start:
+            classifier.record_decisions(messages, ReviewDecision.KEEP)
+            classifier.record_decisions(messages[:1], ReviewDecision.KEEP)
+        start.assert_called_once_with(None)
+
+    def test_only_one_rescore_runs_per_account(self):
+        release = threading.Event()
+        passes = []
+
+        def slow_rescore(account):
+            passes.append(account)
+            release.wait(2)
+
+        with mock.patch.object(classifier, "rescore_backlog", slow_rescore):
+            self.assertTrue(classifier.start_rescore())
+            # Both collapse into a single follow-up pass
+            self.assertFalse(classifier.start_rescore())
+            self.assertFalse(classifier.start_rescore())
+            release.set()
+            for _ in range(100):
+                if not classifier._rescoring:
+                    break
+                time.sleep(0.02)
+
+        self.assertEqual(passes, [None, None])
+        self.assertEqual(classifier._rescoring, {})
+
+
+# ------------------------------------------------------------
+# Largest messages
+# ------------------------------------------------------------
+class LargestMessagesTests(TestCase):
+    def test_streaming_top_k_and_totals(self):
+        def msg(msg_id, size, thread_id, sender, year):
+            return fake_message(msg_id, sender=sender, size=size, thread_id=thread_id,
+                                internal_ms=int(datetime(year, 6, 15).timestamp() * 1000))
+
+        gmail = FakeGmail([
+            msg("a", 5000, "t1", "alice@example.com", 2019),
+            msg("b", 3000, "t1", "bob@example.com", 2019),
+            msg("c", 9000, "t2", "alice@example.com", 2021),
+            msg("d", 100, "t3", "bob@example.com", 2021),
+            msg("e", 7000, "t4", "carol@example.com", 2020),
+            msg("f", 4000, "t2", "alice@example.com", 2020),
+        ])
+        gmail.broken = {"e"}
+
+        result = services.find_largest_messages(gmail, k=3)
+
+        self.assertEqual(result["ids"], ["c", "a", "f"])
+        self.assertEqual([m["size"] for m in result["messages"]], [9000, 5000, 4000])
+        self.assertEqual((result["scanned"], result["total_bytes"]), (5, 21100))
+        self.assertEqual(result["threads"], [
+            {"thread_id": "t2", "bytes": 13000, "count": 2},
+            {"thread_id": "t1", "bytes": 8000, "count": 2},
+            {"thread_id": "t3", "bytes": 100, "count": 1},
+        ])
+        self.assertEqual(result["by_sender"], [
+            {"from": "alice@example.com", "bytes": 18000, "count": 3},
+            {"from": "bob@example.com", "bytes": 3100, "count": 2},
+        ])
+        self.assertEqual(result["by_year"], [
+            {"year": 2019, "bytes": 8000, "count": 2},
+            {"year": 2020, "bytes": 4000, "count": 1},
+            {"year": 2021, "bytes": 9100, "count": 2},
+        ])
@@ -1,19 +1,76 @@
 from django.shortcuts import render
 
 # Create your views here.
-from rest_framework.decorators import api_view
+import base64
+import hmac
+import json
+
+from django.conf import settings
+from django.http import Http404
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.response import Response
 from rest_framework import status
 
+from .classifier import (
+    decision_messages,
+    propose_deletions,
+    record_decision,
+    record_decisions,
+    rescore_backlog,
+)
+from .clustering import delete_cluster, list_clusters
+from .cube import build_cube_from_index, get_cube, start_estimate_rebuild
 from .gmail_auth import authenticate_gmail
-from .serializers import DeleteOldEmailsSerializer
+from .models import GmailAccount, Message, ReviewDecision
+from .scheduler import QUOTA_COSTS
+from .review import create_session, discard_everywhere, get_session
+from .serializers import (
+    ClusterListSerializer,
+    DeleteOldEmailsSerializer,
+    LargestMessagesSerializer,
+    MailboxCubeRefreshSerializer,
+    ProposedDeletionsSerializer,
+    ReviewSessionSerializer,
+)
 from .services import (
     test_authentication,
     list_recent_unread_emails,
     delete_old_unread_emails,
     list_oldest_unread_emails,
+    batch_delete_messages,
+    execute_scheduled,
+    find_largest_in_index,
+    find_largest_messages,
 )
 
+def _account(request):
+    """
+    ?account=<email> picks one of the connected GmailAccounts;
+    without it we use the single-mailbox token.json setup (None).
+    Unknown or disconnected accounts are a 404.
+    """
+    email_address = request.GET.get("account")
+    if not email_address:
+        return None
+    try:
+        return GmailAccount.objects.get(email_address=email_address, is_active=True)
+    except GmailAccount.DoesNotExist:
+        raise Http404(f"No connected Gmail account {email_address}")
+
+
+def _index_missing(account):
+    """
+    Views that read the local index 409 until index_mailbox has run for the
+    account, rather than answering from an empty (or partial) index.
+    """
+    if Message.objects.filter(account=account).exists():
+        return None
+    return Response(
+        {"error": "The local index is empty; run `manage.py index_mailbox` for this account first."},
+        status=status.HTTP_409_CONFLICT,
+    )
+
+
 @api_view(["GET"])
 def test_auth(request):
     if test_authentication():
@@ -29,14 +86,14 @@ def home_page(request):
 
 
 def list_unread_page(request):
-    service = authenticate_gmail()
+    service = authenticate_gmail(_account(request))
     emails = list_recent_unread_emails(service, days=30)
     return render(request, "core/list_unread.html", {"emails": emails})
 
 
 @api_view(["GET"])
 def list_oldest_unread(request):
-    service = authenticate_gmail()
+    service = authenticate_gmail(_account(request))
     emails = list_oldest_unread_emails(service, limit=50, days = 5110)
     print(emails)
     return Response({"emails": emails})
@@ -44,7 +101,7 @@ def list_oldest_unread(request):
 
 @api_view(["GET"])
 def list_recent_unread(request):
-    service = authenticate_gmail()
+    service = authenticate_gmail(_account(request))
     emails = list_recent_unread_emails(service, days=30)
     return Response({"emails": emails})
 
@@ -56,7 +113,7 @@ def delete_old(request):
 
     days_old = serializer.validated_data["days_old"]
 
-    service = authenticate_gmail()
+    service = authenticate_gmail(_account(request))
     # For now we ignore days_old in the service; we’ll wire it up shortly
     deleted_count = delete_old_unread_emails(service)
 
@@ -67,20 +124,100 @@ def delete_single_email(request, message_id):
     """
     Deletes a single email by ID.
     """
+    account = _account(request)
     try:
-        service = authenticate_gmail()
-        service.users().messages().delete(
+        service = authenticate_gmail(account)
+        # Read the features first (the message can't be read once it's gone),
+        # but only record the decision once Gmail has confirmed the delete
+        messages = decision_messages(service, [message_id], account)
+        execute_scheduled(service, service.users().messages().delete(
             userId="me",
             id=message_id
-        ).execute()
+        ), cost=QUOTA_COSTS["messages.delete"])
+        record_decisions(messages, ReviewDecision.DELETE, account)
+        discard_everywhere([message_id])
         
         return Response({"status": "success", "message_id": message_id})
     except Exception as e:
         return Response({"error": str(e)}, status=500)
 
 
+@api_view(["POST"])
+def keep_single_email(request, message_id):
+    """
+    Records that the user chose to keep an email (trains the classifier).
+    """
+    account = _account(request)
+    try:
+        service = authenticate_gmail(account)
+        examples = record_decision(service, message_id, ReviewDecision.KEEP, account=account)
+        discard_everywhere([message_id])
+        return Response({"status": "success", "message_id": message_id, "examples": examples})
+    except Exception as e:
+        return Response({"error": str(e)}, status=500)
+
+
+@api_view(["GET"])
+def proposed_deletions(request):
+    """
+    Messages the review-trained classifier is confident should go.
+    ?threshold=0.9 (0-1) and ?limit=1000 narrow the list.
+    POST the returned "ids" to /api/batch-delete/ to accept them.
+    """
+    serializer = ProposedDeletionsSerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+
+    account = _account(request)
+    missing = _index_missing(account)
+    if missing:
+        return missing
+    return Response(propose_deletions(account=account, **serializer.validated_data))
+
+
+@api_view(["POST"])
+def rescore(request):
+    """Re-scores the whole local index with the current model."""
+    account = _account(request)
+    missing = _index_missing(account)
+    if missing:
+        return missing
+    return Response({"scored": rescore_backlog(account)})
+
+
 def review_page(request):
-    return render(request, 'review.html')
+    return render(request, 'core/email_review.html')
+
+
+@api_view(["POST"])
+def start_review_session(request):
+    """
+    Opens a server-side review session and returns its first page.
+    Body (all optional): {"query": "is:unread", "page_size": 25}
+    Later pages are prefetched in the background while the user works.
+    """
+    serializer = ReviewSessionSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+
+    session = create_session(account=_account(request), **serializer.validated_data)
+    return _review_page(session)
+
+
+@api_view(["GET"])
+def next_review_page(request, session_id):
+    """Next page of an open review session (normally already prefetched)."""
+    session = get_session(session_id)
+    if session is None:
+        return Response({"error": "Unknown or expired review session"}, status=404)
+    return _review_page(session)
+
+
+def _review_page(session):
+    try:
+        emails = session.next_page()
+    except Exception as e:
+        # The session stays open; asking for the page again retries
+        return Response({"session_id": session.id, "error": f"Could not load emails from Gmail: {e}"}, status=502)
+    return Response({"session_id": session.id, "emails": emails, "exhausted": session.exhausted})
 
 
 @api_view(["POST"])
@@ -88,25 +225,167 @@ def batch_delete_emails(request):
     """
     Receives a list of IDs: {'ids': ['123', '456', ...]}
     Deletes them all instantly using Gmail's batchDelete.
+    With "record": true (the review UI) each one is also stored as a
+    delete decision for the classifier, once Gmail has confirmed.
     """
     ids_to_delete = request.data.get("ids", [])
+    record = bool(request.data.get("record", False))
     
     if not ids_to_delete:
         return Response({"error": "No IDs provided"}, status=400)
 
+    account = _account(request)
     try:
-        service = authenticate_gmail()
+        service = authenticate_gmail(account)
+        # Features must be read before the messages are gone
+        examples = decision_messages(service, ids_to_delete, account) if record else []
         
         # This is the "magic" method that deletes multiple emails in one go
-        service.users().messages().batchDelete(
-            userId="me",
-            body={"ids": ids_to_delete}
-        ).execute()
+        # (chunked, since batchDelete caps out at 1000 IDs per call)
+        deleted_count = batch_delete_messages(service, ids_to_delete)
+        if record:
+            record_decisions(examples, ReviewDecision.DELETE, account)
+        Message.objects.filter(account=account, gmail_id__in=ids_to_delete).delete()
+        discard_everywhere(ids_to_delete)
         
         return Response({
             "status": "success", 
-            "deleted_count": len(ids_to_delete)
+            "deleted_count": deleted_count
         })
         
     except Exception as e:
         return Response({"error": str(e)}, status=500)
+
+
+@api_view(["GET"])
+def largest_messages(request):
+    """
+    Top-K largest messages/threads plus bytes per sender and year.
+    Answered from the local index by default; ?source=gmail&q=... scans
+    the messages matching a (narrow) Gmail search live instead.
+    POST the returned "ids" to /api/batch-delete/ to reclaim the space.
+    """
+    serializer = LargestMessagesSerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    account = _account(request)
+
+    if serializer.validated_data["source"] == "index":
+        missing = _index_missing(account)
+        if missing:
+            return missing
+        return Response(find_largest_in_index(account, k=serializer.validated_data["k"]))
+
+    service = authenticate_gmail(account)
+    report = find_largest_messages(
+        service,
+        k=serializer.validated_data["k"],
+        query=serializer.validated_data["q"],
+    )
+    return Response(report)
+
+
+@api_view(["POST"])
+@authentication_classes([])
+@permission_classes([])
+def gmail_push(request):
+    """
+    Pub/Sub push endpoint for Gmail watch notifications.
+    Body: {"message": {"data": base64({"emailAddress": ..., "historyId": ...})}}
+    Acks immediately; the actual history fetch is debounced in core.sync.
+    Refused outright unless GMAIL_PUSH_TOKEN is configured and matches.
+    """
+    from .sync import push_debouncer, watched_mailbox
+
+    token = request.query_params.get("token", "")
+    if not settings.GMAIL_PUSH_TOKEN or not hmac.compare_digest(token, settings.GMAIL_PUSH_TOKEN):
+        return Response({"error": "Invalid token"}, status=403)
+
+    try:
+        data = request.data["message"]["data"]
+        payload = json.loads(base64.b64decode(data))
+        email_address = payload["emailAddress"]
+        history_id = int(payload["historyId"])
+    except (KeyError, TypeError, ValueError) as e:
+        # Not a Gmail notification; nothing to sync
+        return Response({"error": f"Malformed notification: {e}"}, status=400)
+
+    if watched_mailbox(email_address) is None:
+        # Ack anyway so Pub/Sub stops redelivering it
+        print(f"Ignoring push for {email_address}: not a connected mailbox")
+        return Response(status=204)
+
+    push_debouncer.notify(email_address, history_id)
+    return Response(status=204)
+
+
+@api_view(["GET"])
+def list_message_clusters(request):
+    """
+    Near-duplicate/template clusters from the local index, largest first.
+    ?min_size=2 and ?limit=200 trim the list. Clusters are recomputed by
+    the index_mailbox command, not per request.
+    """
+    serializer = ClusterListSerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    options = serializer.validated_data
+
+    account = _account(request)
+    missing = _index_missing(account)
+    if missing:
+        return missing
+
+    clusters = list_clusters(account, min_size=options["min_size"], limit=options["limit"])
+    return Response({"clusters": clusters})
+
+
+@api_view(["POST"])
+def delete_message_cluster(request, cluster_key):
+    """
+    Deletes every message in a cluster in one go (batchDelete).
+    """
+    account = _account(request)
+    try:
+        service = authenticate_gmail(account)
+        deleted_count = delete_cluster(service, cluster_key, account=account)
+        return Response({"status": "success", "deleted_count": deleted_count})
+    except Exception as e:
+        return Response({"error": str(e)}, status=500)
+
+
+@api_view(["GET"])
+def mailbox_cube(request):
+    """
+    Whole-mailbox overview: counts/bytes by year x month x category x unread,
+    straight from the stored cube. Rebuild it with POST
+    /api/mailbox-cube/refresh/ or the build_mailbox_cube command.
+    """
+    return Response(get_cube(_account(request)))
+
+
+@api_view(["POST"])
+def refresh_mailbox_cube(request):
+    """
+    Rebuilds the cube.
+    {"source": "index"} re-aggregates the local index and returns the cube.
+    {"source": "estimate", "from_year": 2010, "to_year": 2015} starts
+    resultSizeEstimate probes for those years in the background (202);
+    GET /api/mailbox-cube/ shows the result once it lands.
+    """
+    serializer = MailboxCubeRefreshSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    options = serializer.validated_data
+
+    account = _account(request)
+    if options["source"] == "index":
+        missing = _index_missing(account)
+        if missing:
+            return missing
+        build_cube_from_index(account)
+        return Response(get_cube(account))
+
+    started = start_estimate_rebuild(
+        authenticate_gmail(account), options["from_year"], options.get("to_year"), account=account
+    )
+    if not started:
+        return Response({"error": "A rebuild is already running for this account"}, status=409)
+    return Response({"status": "started"}, status=status.HTTP_202_ACCEPTED)
@@ -139,4 +139,29 @@ REST_FRAMEWORK = {
     "DEFAULT_PARSER_CLASSES": [
         "rest_framework.parsers.JSONParser",
     ],
-}
\ No newline at end of file
+}
+# Gmail push notifications (users().watch -> Pub/Sub -> /api/gmail/push/)
+# GMAIL_PUSH_TOKEN is a shared secret appended to the push endpoint URL
+# (?token=...) so random POSTs can't trigger syncs. The endpoint refuses
+# every request while it is unset.
+GMAIL_PUSH_TOPIC = os.environ.get("GMAIL_PUSH_TOPIC", "")
+GMAIL_PUSH_TOKEN = os.environ.get("GMAIL_PUSH_TOKEN", "")
+GMAIL_PUSH_DEBOUNCE_SECONDS = float(os.environ.get("GMAIL_PUSH_DEBOUNCE_SECONDS", "2"))
+
+# Gmail client transport: "httplib2" (library default) or "pooled", which
+# keeps a pool of keep-alive connections per account for the life of the
+# worker process (see core/transport.py). Pool size is per process.
+GMAIL_HTTP_TRANSPORT = os.environ.get("GMAIL_HTTP_TRANSPORT", "httplib2")
+GMAIL_HTTP_POOL_SIZE = int(os.environ.get("GMAIL_HTTP_POOL_SIZE", "10"))
+GMAIL_HTTP_TIMEOUT = float(os.environ.get("GMAIL_HTTP_TIMEOUT", "60"))
+
+# Worker threads shared (fairly) by every connected Gmail account
+# (see core/scheduler.py). Per-account quota lives on GmailAccount.
+GMAIL_SCHEDULER_WORKERS = int(os.environ.get("GMAIL_SCHEDULER_WORKERS", "8"))
+
+# Pinned Gmail discovery document used by build_from_document(). Falls
+# back to the copy bundled with google-api-python-client if missing.
+# Refresh it with: python manage.py cache_discovery_document
+GMAIL_DISCOVERY_DOCUMENT = os.environ.get(
+    "GMAIL_DISCOVERY_DOCUMENT", os.path.join(BASE_DIR, "gmail.v1.discovery.json")
+)
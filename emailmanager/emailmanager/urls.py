@@ -24,6 +24,7 @@ urlpatterns = [
 
         # UI pages
     path('', views.home_page),
+    path('review/', views.review_page, name='review'),
     # path('list-unread/', views.list_unread_page),
 
     # API endpoints (DRF)
@@ -33,7 +34,24 @@ urlpatterns = [
     path("api/delete-old/", views.delete_old),
 
     path('api/delete-message/<str:message_id>/', views.delete_single_email, name='delete_single'),
+    path('api/keep-message/<str:message_id>/', views.keep_single_email, name='keep_single'),
 
     path('api/batch-delete/', views.batch_delete_emails, name='batch_delete'),
 
+    path('api/largest-messages/', views.largest_messages, name='largest_messages'),
+
+    path('api/gmail/push/', views.gmail_push, name='gmail_push'),
+
+    path('api/proposed-deletions/', views.proposed_deletions, name='proposed_deletions'),
+    path('api/rescore/', views.rescore, name='rescore'),
+
+    path('api/clusters/', views.list_message_clusters, name='list_clusters'),
+    path('api/clusters/<str:cluster_key>/delete/', views.delete_message_cluster, name='delete_cluster'),
+
+    path('api/mailbox-cube/', views.mailbox_cube, name='mailbox_cube'),
+    path('api/mailbox-cube/refresh/', views.refresh_mailbox_cube, name='refresh_mailbox_cube'),
+
+    path('api/review-session/', views.start_review_session, name='start_review_session'),
+    path('api/review-session/<str:session_id>/next/', views.next_review_page, name='next_review_page'),
+
 ]